@@ -0,0 +1,100 @@
+"""Size and speed benchmark of the compact serialization of the file models.
+
+Compares :meth:`unistorage.models.FileFactory.to_compact_list` and
+:meth:`~unistorage.models.File.to_compact` with pickle (protocol 2) of the
+same files::
+
+    python benchmarks/bench_compact.py [--count 1000]
+"""
+import argparse
+import cPickle
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from unistorage.models import FileFactory
+
+
+def image_response(i):
+    return {
+        'status': 'ok',
+        'data': {
+            'extra': {'width': 100 + i, 'height': 100, 'orientation': 1},
+            'mimetype': 'image/jpeg',
+            'name': 'photo%d.jpeg' % i,
+            'size': 211258 + i,
+            'unistorage_type': 'image',
+            'url': 'http://127.0.0.2/525cde8bf7c07954bec2%05d' % i,
+        },
+        'ttl': 604800,
+    }
+
+
+def video_response(i):
+    return {
+        'status': 'ok',
+        'data': {
+            'extra': {'video': {'width': 1920, 'height': 1080, 'codec': 'h264'}},
+            'mimetype': 'video/mp4',
+            'name': 'video%d.mp4' % i,
+            'size': 7340032 + i,
+            'unistorage_type': 'video',
+            'url': 'http://127.0.0.2/525cde8bf7c07954bec3%05d' % i,
+        },
+        'ttl': 604800,
+    }
+
+
+def build_files(count):
+    files = []
+    for i in xrange(count):
+        response = image_response(i) if i % 2 else video_response(i)
+        files.append(FileFactory.build_from_dict('/%d/' % i, response))
+    return files
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of files in the list')
+    args = parser.parse_args()
+
+    files = build_files(args.count)
+    number = max(10000 // args.count, 1)
+    formats = [
+        ('compact', FileFactory.to_compact_list, FileFactory.from_compact_list),
+        ('pickle', lambda f: pickle.dumps(f, 2), pickle.loads),
+        ('cPickle', lambda f: cPickle.dumps(f, 2), cPickle.loads),
+    ]
+
+    print 'single file'
+    print '%-10s %12s %14s %14s' % ('format', 'size, bytes', 'encode, us', 'decode, us')
+    single = [
+        ('compact', lambda f: f.to_compact(), FileFactory.from_compact),
+    ] + formats[1:]
+    for name, dumps, loads in single:
+        data = dumps(files[0])
+        print '%-10s %12d %14.1f %14.1f' % (
+            name, len(data), measure(lambda: dumps(files[0]), 10000) * 1e6,
+            measure(lambda: loads(data), 10000) * 1e6)
+
+    print
+    print 'list of %d files' % args.count
+    print '%-10s %12s %14s %14s' % ('format', 'bytes/file', 'encode, us', 'decode, us')
+    for name, dumps, loads in formats:
+        data = dumps(files)
+        print '%-10s %12.1f %14.1f %14.1f' % (
+            name, float(len(data)) / args.count,
+            measure(lambda: dumps(files), number) / args.count * 1e6,
+            measure(lambda: loads(data), number) / args.count * 1e6)
+
+
+if __name__ == '__main__':
+    main()
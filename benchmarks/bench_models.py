@@ -0,0 +1,99 @@
+"""Memory and attribute access microbenchmark of the file models.
+
+Compares :class:`unistorage.models.ImageFile` with an equivalent
+``__dict__``-based class that hooks ``__getattribute__`` (the way the models
+were implemented before they got ``__slots__``)::
+
+    python benchmarks/bench_models.py [--count 100000]
+"""
+import argparse
+import gc
+import os
+import sys
+import timeit
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from unistorage.models import ImageFile
+
+
+class LegacyImageFile(object):
+    def __init__(self, resource_uri, response):
+        self.resource_uri = resource_uri
+        self.ttl = response.get('ttl')
+        data = response['data']
+        self.url = data['url']
+        self.mimetype = data['mimetype']
+        self.size = data['size']
+        self.name = data['name']
+        extra = data['extra']
+        self.width = extra['width']
+        self.height = extra['height']
+        self.orientation = extra['orientation']
+
+    def __getattribute__(self, name):
+        rv = super(LegacyImageFile, self).__getattribute__(name)
+        if name == 'ttl':
+            warnings.warn('ttl is deprecated', FutureWarning, stacklevel=2)
+        return rv
+
+
+RESPONSE = {
+    'status': 'ok',
+    'data': {
+        'extra': {'width': 100, 'height': 100, 'orientation': 1},
+        'mimetype': 'image/jpeg',
+        'name': 'some.jpeg',
+        'size': 211258,
+        'unistorage_type': 'image',
+        'url': 'http://127.0.0.2/525cde8bf7c07954bec2552f',
+    },
+    'ttl': 604800,
+}
+
+
+def object_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def rss_per_object(cls, count):
+    """Returns growth of the peak RSS per object (in bytes) while `count`
+    objects of `cls` are alive. Uses /proc/self/statm where available."""
+    def rss():
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if not os.path.exists('/proc/self/statm'):
+        return None
+    gc.collect()
+    before = rss()
+    objects = [cls('/%d/' % i, RESPONSE) for i in xrange(count)]
+    after = rss()
+    del objects
+    return float(after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of objects for the RSS measurement')
+    args = parser.parse_args()
+
+    print '%-16s %12s %14s %14s' % ('class', 'size, bytes', 'RSS/object', 'getattr, ns')
+    for cls in (LegacyImageFile, ImageFile):
+        obj = cls('/1/', RESPONSE)
+        number = 1000000
+        seconds = timeit.timeit('obj.width; obj.url; obj.size', number=number,
+                                setup='from __main__ import %s, RESPONSE; '
+                                      'obj = %s("/1/", RESPONSE)' % (cls.__name__, cls.__name__))
+        rss = rss_per_object(cls, args.count)
+        print '%-16s %12d %14s %14.1f' % (
+            cls.__name__, object_size(obj), rss is None and '-' or '%.1f' % rss,
+            seconds / number / 3 * 1e9)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Local stand-in for the Unistorage API used by the benchmarks.
+
+Implements file uploads (``POST /``), templates (``POST /template/``),
+archives (``POST /zip/``), file metadata (``GET /<id>/``) with ``action`` and
+``template`` parameters, and binary content (``GET /content/<id>``)::
+
+    python benchmarks/fake_server.py --port 5000 --latency 0.005
+
+Request bodies are read and discarded in chunks, so multi-gigabyte uploads
+don't consume memory.
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qsl
+
+
+CHUNK_SIZE = 65536
+
+
+class FakeUnistorageServer(ThreadingMixIn, HTTPServer):
+    """
+    :param latency: Seconds to wait before every response.
+    :param content_size: Size of the binary content of every file in bytes.
+    :param padding: Number of extra bytes in every metadata response.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.0, content_size=65536, padding=0):
+        HTTPServer.__init__(self, address, FakeUnistorageHandler)
+        self.latency = latency
+        self.content_size = content_size
+        self.padding = 'x' * padding
+        self.ids = itertools.count(1)
+        self.url = 'http://%s:%d/' % self.server_address
+
+    def new_uri(self):
+        return '/%024x/' % next(self.ids)
+
+
+class FakeUnistorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def discard_body(self):
+        """Reads the request body; returns its size."""
+        size = 0
+        if self.headers.getheader('Transfer-Encoding') == 'chunked':
+            while True:
+                length = int(self.rfile.readline().strip(), 16)
+                size += self.discard(length)
+                self.rfile.readline()
+                if not length:
+                    return size
+        return self.discard(int(self.headers.getheader('Content-Length') or 0))
+
+    def discard(self, length):
+        left = length
+        while left:
+            left -= len(self.rfile.read(min(left, CHUNK_SIZE)))
+        return length
+
+    def send(self, status_code, body, content_type='application/json'):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status_code=200):
+        self.send(status_code, json.dumps(data))
+
+    def do_POST(self):
+        self.discard_body()
+        path = urlparse(self.path).path
+        if path in ('/', '/template/', '/zip/'):
+            self.send_json({'resource_uri': self.server.new_uri()})
+        else:
+            self.send_json({'msg': 'Not found'}, 404)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = dict(parse_qsl(parsed.query))
+        if parsed.path.startswith('/content/'):
+            return self.send_content()
+        if 'action' in query or 'template' in query:
+            return self.send_json({'resource_uri': self.server.new_uri()})
+
+        server = self.server
+        self.send_json({
+            'status': 'ok',
+            'ttl': 604800,
+            'data': {
+                'url': '%scontent%s' % (server.url, parsed.path.rstrip('/')),
+                'mimetype': 'image/jpeg',
+                'name': 'image.jpg',
+                'size': server.content_size,
+                'unistorage_type': 'image',
+                'extra': {'width': 100, 'height': 100, 'orientation': 1,
+                          'padding': server.padding},
+            },
+        })
+
+    def send_content(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        size = self.server.content_size
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = '\0' * CHUNK_SIZE
+        while size:
+            self.wfile.write(chunk[:size])
+            size -= min(size, CHUNK_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before every response')
+    parser.add_argument('--content-size', type=int, default=65536,
+                        help='size of the file content in bytes')
+    parser.add_argument('--padding', type=int, default=0,
+                        help='extra bytes in every metadata response')
+    args = parser.parse_args()
+
+    server = FakeUnistorageServer((args.host, args.port), latency=args.latency,
+                                  content_size=args.content_size,
+                                  padding=args.padding)
+    # The benchmark runner reads the URL from the first line of the output
+    print server.url
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""End-to-end benchmarks of the client against a local fake Unistorage server.
+
+Starts ``benchmarks/fake_server.py`` in a subprocess (so its memory isn't
+counted), runs every scenario and writes machine-readable results::
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --large-upload-size 4096 --baseline results.json
+    python benchmarks/run.py --content-size 10485760 --scenarios stream_zipped
+
+Each scenario reports throughput (operations per second), p50/p99 latency in
+seconds and the peak RSS of the benchmark process after the scenario. Peak RSS
+never decreases during the life of a process, so the scenarios whose memory
+usage matters (large upload, ZIP streaming) run in their own processes; the
+values of the others include the scenarios that ran before them.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from unistorage import Action, UnistorageClient
+from unistorage.transport import RequestsTransport, Urllib3Transport
+
+TRANSPORTS = {
+    'requests': RequestsTransport,
+    'urllib3': Urllib3Transport,
+}
+
+#: Scenarios that run in a separate process, so their peak RSS is their own.
+ISOLATED_SCENARIOS = ('upload_file_large', 'stream_zipped')
+
+
+def peak_rss():
+    """Returns peak RSS of this process in bytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def measure(operation, count, concurrency=1):
+    """Calls `operation` with numbers ``0..count-1`` using `concurrency` threads."""
+    latencies = []
+
+    def timed(number):
+        started_at = time.time()
+        operation(number)
+        latencies.append(time.time() - started_at)
+
+    started_at = time.time()
+    if concurrency == 1:
+        for number in xrange(count):
+            timed(number)
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(timed, xrange(count)))
+    elapsed = time.time() - started_at
+    return {
+        'count': count,
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'ops_per_second': count / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'peak_rss': peak_rss(),
+    }
+
+
+class NullWriter(object):
+    def write(self, data):
+        pass
+
+
+def run_isolated(name, url, args):
+    """Runs the scenario `name` in a new process against the server at `url`."""
+    command = [sys.executable, os.path.abspath(__file__), '--url', url,
+               '--scenarios', name]
+    for option in ('count', 'concurrency', 'small_upload_size',
+                   'large_upload_size', 'transport'):
+        command += ['--' + option.replace('_', '-'), str(getattr(args, option))]
+    return json.loads(subprocess.check_output(command))[name]
+
+
+def sparse_file(size):
+    f = tempfile.TemporaryFile()
+    f.truncate(size)
+    return f
+
+
+def run_scenarios(unistorage, url, args):
+    uris = ['/%024x/' % i for i in xrange(args.count)]
+    image_file = unistorage.get_file(uris[0])
+    small_content = '\0' * args.small_upload_size
+    chain = [Action('resize', {'mode': 'keep', 'w': 100, 'h': 100}),
+             Action('grayscale'), Action('rotate', {'angle': 90})]
+
+    template = unistorage.create_template('image', chain)
+    album = [unistorage.get_file(uri) for uri in uris[:100]]
+
+    def upload_large(number):
+        with sparse_file(args.large_upload_size * 2 ** 20) as f:
+            unistorage.upload_file('large.bin', f, lazy=True)
+
+    def apply_chain(number):
+        file = image_file
+        for action in chain:
+            file = unistorage.apply_action(file, action)
+
+    scenarios = [
+        ('get_file', lambda n: unistorage.get_file(uris[n]), args.count, 1),
+        ('get_file_concurrent', lambda n: unistorage.get_file(uris[n]),
+         args.count, args.concurrency),
+        ('get_files_batch', lambda n: unistorage.get_files(uris[:50]),
+         max(args.count / 50, 1), 1),
+        ('upload_file_small', lambda n: unistorage.upload_file('small.bin', small_content),
+         args.count, args.concurrency),
+        ('upload_file_large', upload_large, 1, 1),
+        ('apply_action_chain', apply_chain, max(args.count / len(chain), 1), 1),
+        ('apply_actions_pipeline', lambda n: unistorage.apply_actions(image_file, chain),
+         max(args.count / len(chain), 1), 1),
+        ('apply_template_serial',
+         lambda n: [unistorage.apply_template(file, template) for file in album],
+         max(args.count / 100, 1), 1),
+        ('apply_template_many', lambda n: unistorage.apply_template_many(album, template),
+         max(args.count / 100, 1), 1),
+        ('stream_zipped', lambda n: unistorage.stream_zipped(album, NullWriter()),
+         max(args.count / 100, 1), 1),
+        ('get_zipped', lambda n: unistorage.get_zipped('files.zip', [image_file] * 100),
+         max(args.count / 10, 1), 1),
+    ]
+    results = {}
+    for name, operation, count, concurrency in scenarios:
+        if args.scenarios and name not in args.scenarios:
+            continue
+        if name in ISOLATED_SCENARIOS and not args.url:
+            results[name] = run_isolated(name, url, args)
+        else:
+            results[name] = measure(operation, count, concurrency)
+            if name == 'upload_file_large':
+                results[name]['mb_per_second'] = (
+                    args.large_upload_size / results[name]['elapsed'])
+        if not args.url:
+            print_result(name, results[name])
+    return results
+
+
+def print_result(name, result):
+    line = '%-24s %10.1f ops/s  p50 %8.2f ms  p99 %8.2f ms  rss %7.1f MB' % (
+        name, result['ops_per_second'], result['p50'] * 1000, result['p99'] * 1000,
+        result['peak_rss'] / 2.0 ** 20)
+    print line
+
+
+def compare(results, baseline):
+    print '\n%-24s %14s %14s' % ('scenario', 'ops/s change', 'p99 change')
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        print '%-24s %+13.1f%% %+13.1f%%' % (
+            name, 100.0 * (result['ops_per_second'] / old['ops_per_second'] - 1),
+            100.0 * (result['p99'] / old['p99'] - 1) if old['p99'] else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=500,
+                        help='number of operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='server latency in seconds')
+    parser.add_argument('--padding', type=int, default=0,
+                        help='extra bytes in every metadata response')
+    parser.add_argument('--content-size', type=int, default=65536,
+                        help='size of the content of every file in bytes '
+                             '(downloaded by stream_zipped)')
+    parser.add_argument('--small-upload-size', type=int, default=16384,
+                        help='size of small uploads in bytes')
+    parser.add_argument('--large-upload-size', type=int, default=256,
+                        help='size of the large streamed upload in MB')
+    parser.add_argument('--transport', choices=sorted(TRANSPORTS), default='requests')
+    parser.add_argument('--scenarios', nargs='*', help='scenarios to run')
+    parser.add_argument('--output', help='path of the JSON file for the results')
+    parser.add_argument('--baseline', help='path of the JSON results to compare with')
+    parser.add_argument('--url', help='URL of a running fake server; the results '
+                                      'are printed as JSON (used by isolated scenarios)')
+    args = parser.parse_args()
+
+    if args.url:
+        transport = TRANSPORTS[args.transport](pool_maxsize=args.concurrency)
+        with UnistorageClient(args.url, 'benchmark', transport=transport) as unistorage:
+            print json.dumps(run_scenarios(unistorage, args.url, args))
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), 'fake_server.py'),
+         '--latency', str(args.latency), '--padding', str(args.padding),
+         '--content-size', str(args.content_size)],
+        stdout=subprocess.PIPE)
+    try:
+        url = server.stdout.readline().strip()
+        transport = TRANSPORTS[args.transport](pool_maxsize=args.concurrency)
+        with UnistorageClient(url, 'benchmark', transport=transport) as unistorage:
+            results = run_scenarios(unistorage, url, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
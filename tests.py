@@ -1,7 +1,45 @@
+import cgi
+import json
+import os
+import pickle
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import warnings
+import zipfile
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from urlparse import urlparse, parse_qsl
 
+from requests.exceptions import ChunkedEncodingError, ConnectionError, ReadTimeout
+
+from unistorage.async_client import AsyncUnistorageClient
+from unistorage.cache import MetadataCache
+from unistorage.dedup import UploadIndex
+from unistorage.memo import DerivedFileMemo
+from unistorage.prefetch import Prefetcher
+from unistorage.balancer import LoadBalancer
+from unistorage.limits import AdaptiveConcurrencyLimit, RequestLimiter, TokenBucket
+from unistorage import zipstream
+from unistorage.client import (UnistorageClient, UnistorageError, UnistorageTimeout,
+                               UnistorageCircuitOpen, UnistorageConnectionError)
+from unistorage.retry import RetryPolicy, CircuitBreaker
+from unistorage.templates import TemplateRegistry
+from unistorage.waiter import PendingFileWaiter
+from unistorage.instrumentation import HistogramCollector
+from unistorage.transport import (InMemoryResponse, InMemoryTransport, Transport,
+                                  Urllib3Transport)
+from unistorage.singleflight import SingleFlight
+from unistorage.compact import CompactError
 from unistorage.models import (FileFactory, TemporaryFile, PendingFile,
-                               ImageFile, VideoFile, DocFile)
+                               ImageFile, VideoFile, DocFile, Action, LazyFile,
+                               Template, RegularFile, AudioFile, ZipFile)
 
 
 class TestFileFactory(unittest.TestCase):
@@ -76,3 +114,1131 @@ class TestFileFactory(unittest.TestCase):
         response = self.get_ok_video_response()
         result = FileFactory.build_from_dict(None, response)
         self.assertIs(type(result), VideoFile)
+
+
+class TestModels(unittest.TestCase):
+    def setUp(self):
+        self.image_file = FileFactory.build_from_dict(
+            '/1/', TestFileFactory('test_ok').get_ok_image_response())
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.image_file, '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.image_file, 'foo', 1)
+
+    def test_ttl(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(self.image_file.ttl, 604800)
+            self.image_file.ttl = None
+            self.assertEqual(self.image_file.ttl, sys.maxint)
+        self.assertEqual([warning.category for warning in caught], [FutureWarning] * 2)
+
+        pending_file = PendingFile('/2/', {'ttl': 5})
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(pending_file.ttl, 5)
+        self.assertEqual(caught, [])
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            image_file = pickle.loads(pickle.dumps(self.image_file, protocol))
+            self.assertIs(type(image_file), ImageFile)
+            self.assertEqual(image_file.__getstate__(), self.image_file.__getstate__())
+
+    def test_compact(self):
+        factory = TestFileFactory('test_ok')
+        files = [self.image_file,
+                 FileFactory.build_from_dict(u'/2/', factory.get_ok_video_response()),
+                 FileFactory.build_from_dict('/3/', factory.get_just_uri_response()),
+                 FileFactory.build_from_dict('/4/', factory.get_wait_response()),
+                 ZipFile('/5/', {'data': {'url': u'http://localhost/5'}})]
+        for file_class, unistorage_type in [(RegularFile, 'unknown'), (AudioFile, 'audio'),
+                                            (DocFile, 'doc')]:
+            response = factory.get_ok_image_response()
+            response['data'].update(unistorage_type=unistorage_type, size=-2 ** 40,
+                                    name=u'\u0444.txt')
+            del response['ttl']
+            files.append(FileFactory.build_from_dict('/6/', response))
+            self.assertIs(type(files[-1]), file_class)
+
+        for file in files:
+            restored = type(file).from_compact(file.to_compact())
+            self.assertIs(type(restored), type(file))
+            self.assertEqual(restored.__getstate__(), file.__getstate__())
+            self.assertEqual([type(value) for value in restored.__getstate__().values()],
+                             [type(value) for value in file.__getstate__().values()])
+            self.assertLess(len(file.to_compact()), len(pickle.dumps(file, 2)))
+
+        encoded = FileFactory.to_compact_list(files)
+        self.assertLess(len(encoded), sum(len(file.to_compact()) for file in files))
+        self.assertEqual([file.__getstate__() for file in FileFactory.from_compact_list(encoded)],
+                         [file.__getstate__() for file in files])
+        self.assertEqual(FileFactory.from_compact_list(FileFactory.to_compact_list([])), [])
+
+        data = self.image_file.to_compact()
+        self.assertRaises(CompactError, VideoFile.from_compact, data)
+        self.assertRaises(CompactError, FileFactory.from_compact, data[:-1])
+        self.assertRaises(CompactError, FileFactory.from_compact, data + '\0')
+        self.assertRaises(CompactError, FileFactory.from_compact, '\2' + data[1:])
+        self.assertRaises(CompactError, FileFactory.from_compact, encoded)
+
+
+class FakeUnistorageServer(ThreadingMixIn, HTTPServer):
+    """Local HTTP server that answers with ``responses[(method, path)]``.
+
+    Each response is a ``(status_code, dictionary)`` tuple or a callable that
+    receives the request handler and returns such a tuple. A string in place of
+    the dictionary is sent as is; an optional third item is a dictionary of
+    headers.
+    """
+    daemon_threads = True
+
+    def __init__(self, responses=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeUnistorageHandler)
+        self.responses = responses or {}
+        self.requests = []
+        self.url = 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeUnistorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, method):
+        parsed = urlparse(self.path)
+        if self.headers.getheader('Transfer-Encoding') == 'chunked':
+            self.body = self.read_chunked()
+        else:
+            self.body = self.rfile.read(int(self.headers.getheader('Content-Length') or 0))
+        self.query = dict(parse_qsl(parsed.query))
+        self.server.requests.append((method, parsed.path, self.query))
+        response = self.server.responses.get((method, parsed.path), (404, {'msg': 'Not found'}))
+        if callable(response):
+            response = response(self)
+        status_code, data = response[:2]
+        headers = len(response) > 2 and response[2] or {}
+        if isinstance(data, str):
+            content = data
+        else:
+            content = json.dumps(data)
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(status_code)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_chunked(self):
+        chunks = []
+        while True:
+            length = int(self.rfile.readline().strip(), 16)
+            chunks.append(self.rfile.read(length))
+            self.rfile.readline()
+            if not length:
+                return ''.join(chunks)
+
+    def form(self):
+        return cgi.FieldStorage(fp=StringIO(self.body), headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST'})
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+
+class TestUnistorageClient(unittest.TestCase):
+    wait_response = {'status': 'wait', 'ttl': 5}
+
+    def test_connections_are_reused(self):
+        responses = {('GET', '/1/'): (200, self.wait_response)}
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                for _ in range(3):
+                    self.assertIsInstance(unistorage.get_file('/1/'), PendingFile)
+                stats = unistorage.connection_stats
+        self.assertEqual(stats, {'requests': 3, 'opened': 1, 'reused': 2})
+
+    def test_keep_alive_disabled(self):
+        responses = {('GET', '/1/'): (200, self.wait_response)}
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token', keep_alive=False) as unistorage:
+                unistorage.get_file('/1/')
+                unistorage.get_file('/1/')
+                stats = unistorage.connection_stats
+        self.assertEqual(stats['opened'], 2)
+
+    def test_get_files(self):
+        responses = {
+            ('GET', '/%d/' % i): (200, self.wait_response) for i in range(10)}
+        uris = ['/%d/' % i for i in range(12)]
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                files = unistorage.get_files(uris, max_workers=4)
+                streamed = dict(unistorage.iter_files(iter(uris), max_workers=4))
+        self.assertEqual([str(file) for file in files[:10]], uris[:10])
+        self.assertEqual([error.status_code for error in files[10:]], [404, 404])
+        self.assertEqual(set(streamed), set(uris))
+        self.assertIsInstance(streamed['/11/'], UnistorageError)
+
+    def test_connection_errors(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        listener.close()
+        image_file = FileFactory.build_from_dict(
+            '/1/', TestFileFactory('test_ok').get_ok_image_response())
+        with UnistorageClient(url, 'token') as unistorage:
+            self.assertRaises(ConnectionError, unistorage.get_file, '/1/')
+            results = [unistorage.get_files(['/1/', '/2/']),
+                       [file for _, file in unistorage.iter_files(['/1/', '/2/'])],
+                       unistorage.apply_action_many([image_file], Action('grayscale')),
+                       unistorage.apply_template_many([image_file], Template('/t/'))]
+        for result in results:
+            for error in result:
+                self.assertIsInstance(error, UnistorageConnectionError)
+                self.assertIsNone(error.status_code)
+
+    def test_upload_file(self):
+        uploads = []
+
+        def upload(handler):
+            form = handler.form()
+            uploads.append((form['file'].filename, form['file'].value,
+                            form.getfirst('type_id'),
+                            handler.headers.getheader('Transfer-Encoding')))
+            return 200, {'resource_uri': '/1/'}
+
+        responses = {('POST', '/'): upload, ('GET', '/1/'): (200, self.wait_response)}
+        content = 'x' * 100000
+        progress = []
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            f.seek(0)
+            with FakeUnistorageServer(responses) as server:
+                with UnistorageClient(server.url, 'token') as unistorage:
+                    unistorage.upload_file(u'\u0444.txt', f, type_id='qwerty', chunk_size=4096,
+                                           callback=lambda *args: progress.append(args))
+                    unistorage.upload_file('b.txt', iter([content[:10], content[10:]]))
+                    read_fd, write_fd = os.pipe()
+                    os.write(write_fd, 'piped')
+                    os.close(write_fd)
+                    with os.fdopen(read_fd, 'rb') as pipe:
+                        unistorage.upload_file('c.txt', pipe)
+        self.assertEqual(uploads, [
+            (u'\u0444.txt'.encode('utf-8'), content, 'qwerty', None),
+            ('b.txt', content, None, 'chunked'),
+            ('c.txt', 'piped', None, 'chunked'),
+        ])
+        sent, total = progress[-1]
+        self.assertEqual(sent, total)
+        self.assertGreater(len(progress), 100000 / 4096)
+
+    def test_download(self):
+        content = ''.join(chr(i % 256) for i in range(10000))
+
+        def serve_content(handler):
+            requested_range = handler.headers.getheader('Range')
+            if not requested_range:
+                return 200, content
+            start, end = requested_range[len('bytes='):].split('-')
+            end = end and int(end) or len(content) - 1
+            return 206, content[int(start):end + 1], {
+                'Content-Range': 'bytes %s-%d/%d' % (start, end, len(content))}
+
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        with FakeUnistorageServer({('GET', '/content'): serve_content}) as server:
+            image_response['data'].update(url=server.url + 'content', size=len(content))
+            image_file = ImageFile('/1/', image_response)
+            with UnistorageClient(server.url, 'token') as unistorage:
+                chunks = list(unistorage.iter_content(image_file, chunk_size=4096))
+                self.assertEqual([len(chunk) for chunk in chunks], [4096, 4096, 1808])
+                self.assertEqual(''.join(unistorage.iter_content(
+                    image_file, start=10, end=19)), content[10:20])
+
+                dest = StringIO()
+                dest.write(content[:3000])
+                self.assertEqual(unistorage.download(image_file, dest, resume=True), 10000)
+                self.assertEqual(dest.getvalue(), content)
+
+                image_file.size += 1
+                self.assertRaises(UnistorageError, unistorage.download, image_file, StringIO())
+
+    def test_download_errors(self):
+        class BrokenResponse(InMemoryResponse):
+            def iter_content(self, chunk_size=65536):
+                yield 'x' * chunk_size
+                raise self.content
+
+        class BrokenTransport(Transport):
+            def request(self, method, url, **kwargs):
+                if url.endswith('refused'):
+                    raise ConnectionError('Connection refused')
+                return BrokenResponse(200, ReadTimeout() if url.endswith('slow') else
+                                      ConnectionError('Connection reset'))
+
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        with UnistorageClient('http://unistorage/', 'token',
+                              transport=BrokenTransport()) as unistorage:
+            for url, error in [('refused', UnistorageConnectionError),
+                               ('reset', UnistorageConnectionError),
+                               ('slow', UnistorageTimeout)]:
+                image_response['data']['url'] = 'http://unistorage/' + url
+                image_file = ImageFile('/1/', image_response)
+                self.assertRaises(error, unistorage.download, image_file, StringIO())
+
+    def test_lazy_results(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        responses = {
+            ('POST', '/'): (200, {'resource_uri': '/1/'}),
+            ('GET', '/1/'): lambda handler: (
+                (200, {'resource_uri': '/2/'}) if handler.query else (200, image_response)),
+            ('GET', '/2/'): lambda handler: (
+                (200, {'resource_uri': '/3/'}) if handler.query else (200, image_response)),
+        }
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                uploaded = unistorage.upload_file('a.jpg', 'content', lazy=True)
+                resized = unistorage.apply_action(
+                    uploaded, Action('resize', {'mode': 'crop', 'w': 50, 'h': 50}), lazy=True)
+                self.assertIsInstance(resized, LazyFile)
+                self.assertEqual(len(server.requests), 2)
+                self.assertEqual(resized.width, 100)
+                self.assertIs(type(resized.file), ImageFile)
+                rotated = resized.rotate(unistorage, 90, lazy=True)
+        self.assertEqual(str(rotated), '/3/')
+        self.assertEqual([path for _, path, _ in server.requests], ['/', '/1/', '/2/', '/2/'])
+
+    def test_apply_many(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        queries = []
+
+        def source(handler):
+            queries.append(handler.query)
+            number = urlparse(handler.path).path.strip('/')
+            if number == '4':
+                return 404, {'msg': 'Not found'}
+            return 200, {'resource_uri': '/r%s/' % number}
+
+        responses = dict(
+            [(('GET', '/%d/' % i), source) for i in range(5)] +
+            [(('GET', '/r%d/' % i), (200, image_response)) for i in range(1, 5)] +
+            [(('GET', '/r0/'), (200, self.wait_response))])
+        files = [ImageFile('/%d/' % i, image_response) for i in range(5)]
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                results = unistorage.apply_template_many(
+                    files, Template('/t/'), with_low_priority=True, max_workers=3)
+                lazy_results = unistorage.apply_action_many(
+                    files[:2], Action('grayscale'), with_low_priority=True, lazy=True)
+        self.assertEqual([type(result) for result in results],
+                         [PendingFile, ImageFile, ImageFile, ImageFile, UnistorageError])
+        self.assertEqual([str(result) for result in results[:4]],
+                         ['/r0/', '/r1/', '/r2/', '/r3/'])
+        self.assertEqual([str(result) for result in lazy_results], ['/r0/', '/r1/'])
+        self.assertTrue(all(query['with_low_priority'] == '1' for query in queries))
+        self.assertEqual(sorted(set(query.get('action') for query in queries)),
+                         [None, 'grayscale'])
+
+    def test_upload_files(self):
+        def upload(handler):
+            if handler.form()['file'].filename == 'bad.txt':
+                return 500, {'msg': 'Internal error'}
+            return 200, {'resource_uri': '/1/'}
+
+        files = [StringIO('x' * 1000) for _ in range(5)]
+        items = [('%d.txt' % i, f, None) for i, f in enumerate(files)]
+        items.append(('bad.txt', StringIO('y'), None))
+        with FakeUnistorageServer({('POST', '/'): upload}) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                progress = []
+                batch = unistorage.upload_files(iter(items), max_workers=2, lazy=True,
+                                                callback=lambda *args: progress.append(args))
+                results = dict(batch)
+        self.assertEqual(sorted(results), sorted(name for name, _, _ in items))
+        self.assertEqual(results['bad.txt'].status_code, 500)
+        self.assertEqual(str(results['0.txt']), '/1/')
+        self.assertTrue(all(f.closed for f in files))
+        stats = batch.stats
+        self.assertEqual((stats['uploaded'], stats['failed']), (5, 1))
+        self.assertGreater(stats['bytes_sent'], 5000)
+        self.assertGreater(stats['files_per_second'], 0)
+        self.assertEqual(sum(sent for sent, total in progress if sent == total),
+                         stats['bytes_sent'])
+
+    def test_error(self):
+        with FakeUnistorageServer() as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                with self.assertRaises(UnistorageError) as context:
+                    unistorage.get_file('/missing/')
+        self.assertEqual(context.exception.status_code, 404)
+        self.assertEqual(context.exception.msg, 'Not found')
+
+
+class TestZipStream(unittest.TestCase):
+    def test_stream_zipped(self):
+        contents = ['x' * 100000, '', 'abc' * 1000, 'z']
+        names = ['a.jpg', 'a.jpg', u'\u0444.txt', 'a.jpg']
+        responses = dict((('GET', '/content/%d' % i), (200, content))
+                         for i, content in enumerate(contents))
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        with FakeUnistorageServer(responses) as server:
+            files = []
+            for i, content in enumerate(contents):
+                image_response['data'].update(url='%scontent/%d' % (server.url, i),
+                                              size=len(content), name=names[i])
+                files.append(ImageFile('/%d/' % i, image_response))
+            with UnistorageClient(server.url, 'token') as unistorage:
+                stored = StringIO()
+                size = unistorage.stream_zipped(files, stored, max_workers=2)
+                deflated = ''.join(unistorage.stream_zipped(
+                    files, compression=zipfile.ZIP_DEFLATED, chunk_size=1024))
+                count_limit, zipstream.ZIP64_COUNT_LIMIT = zipstream.ZIP64_COUNT_LIMIT, 2
+                try:
+                    zip64 = ''.join(unistorage.stream_zipped(files))
+                finally:
+                    zipstream.ZIP64_COUNT_LIMIT = count_limit
+                files[0].size += 1
+                self.assertRaises(UnistorageError, unistorage.stream_zipped, files, StringIO())
+
+        self.assertEqual(size, len(stored.getvalue()))
+        self.assertLess(len(deflated), size)
+        self.assertIn('PK\x06\x06', zip64)
+        for data in (stored.getvalue(), deflated, zip64):
+            archive = zipfile.ZipFile(StringIO(data))
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(),
+                             ['a.jpg', 'a (1).jpg', u'\u0444.txt', 'a (2).jpg'])
+            self.assertEqual([archive.read(name) for name in archive.namelist()], contents)
+
+
+class TestAsyncUnistorageClient(unittest.TestCase):
+    def test_action_returns_future(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        responses = {
+            ('GET', '/1/'): lambda handler: (
+                (200, {'resource_uri': '/2/'}) if handler.query else (200, image_response)),
+            ('GET', '/2/'): (200, {'status': 'wait', 'ttl': 5}),
+        }
+        with FakeUnistorageServer(responses) as server:
+            with AsyncUnistorageClient(server.url, 'token') as unistorage:
+                image_file = unistorage.get_file('/1/').result()
+                self.assertIs(type(image_file), ImageFile)
+                future = image_file.resize(unistorage, 'crop', 50, 50)
+                self.assertIs(type(future.result()), PendingFile)
+        self.assertIn(('GET', '/1/', {'action': 'resize', 'mode': 'crop',
+                                      'w': '50', 'h': '50'}), server.requests)
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = MetadataCache(max_size=2, max_ttl=100, negative_ttl=10,
+                                   clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.cache.set('/1/', 'pending', ttl=5)
+        self.cache.set('/2/', 'regular', ttl=None)
+        self.now = 6
+        self.assertIsNone(self.cache.get('/1/'))
+        self.assertEqual(self.cache.get('/2/'), 'regular')
+        self.now = 101
+        self.assertIsNone(self.cache.get('/2/'))
+        self.assertEqual(self.cache.stats, {'hits': 1, 'misses': 2, 'evictions': 0, 'size': 0})
+
+    def test_lru_eviction(self):
+        self.cache.set('/1/', 1)
+        self.cache.set('/2/', 2)
+        self.cache.get('/1/')
+        self.cache.set('/3/', 3)
+        self.assertIsNone(self.cache.get('/2/'))
+        self.assertEqual(self.cache.get('/1/'), 1)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_client(self):
+        responses = {('GET', '/1/'): (200, {'status': 'wait', 'ttl': 5})}
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token', cache=self.cache) as unistorage:
+                first = unistorage.get_file('/1/')
+                self.assertIs(unistorage.get_file('/1/'), first)
+                for _ in range(2):
+                    self.assertRaises(UnistorageError, unistorage.get_file, '/missing/')
+                self.cache.invalidate('/1/')
+                unistorage.get_file('/1/')
+        self.assertEqual([path for _, path, _ in server.requests],
+                         ['/1/', '/missing/', '/1/'])
+
+
+class TestPendingFileWaiter(unittest.TestCase):
+    def test_wait(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        polls = []
+
+        def pending_twice(handler):
+            polls.append(handler.path)
+            return (200, image_response if len(polls) > 2 else {'status': 'wait', 'ttl': 0})
+
+        responses = {
+            ('GET', '/1/'): pending_twice,
+            ('GET', '/2/'): (200, {'status': 'wait', 'ttl': 0}),
+            ('GET', '/3/'): (200, TestFileFactory('test_ok').get_just_uri_response()),
+        }
+        pending = PendingFile('/1/', {'ttl': 0})
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                waiter = PendingFileWaiter(unistorage, min_interval=0.01, backoff=1)
+                with waiter:
+                    futures = [waiter.wait(pending) for _ in range(3)]
+                    results = waiter.wait_all(
+                        [PendingFile('/2/', {}), PendingFile('/3/', {}), pending],
+                        timeout=0.2)
+        self.assertEqual(len(polls), 3)
+        self.assertEqual(set(type(future.result()) for future in futures), set([ImageFile]))
+        self.assertIsInstance(results[0], UnistorageTimeout)
+        self.assertIs(type(results[1]), TemporaryFile)
+        self.assertIs(type(results[2]), ImageFile)
+
+    def test_coalesced_polls(self):
+        polls = []
+
+        def handler(request):
+            polls.append(request.path)
+            return 200, {'status': 'wait', 'ttl': 0}
+
+        with UnistorageClient('http://unistorage/', 'token',
+                              transport=InMemoryTransport(handler)) as unistorage:
+            with PendingFileWaiter(unistorage, min_interval=0.1, backoff=1) as waiter:
+                futures = [waiter.wait(PendingFile('/1/', {}), timeout=0.5 + i * 0.01)
+                           for i in range(8)]
+                for future in futures:
+                    self.assertRaises(UnistorageTimeout, future.result, 2)
+        self.assertTrue(3 <= len(polls) <= 7, polls)
+
+    def test_connection_error(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+        listener.close()
+        with UnistorageClient(url, 'token') as unistorage:
+            with PendingFileWaiter(unistorage, min_interval=0.1) as waiter:
+                future = waiter.wait(PendingFile('/1/', {}), timeout=0.5)
+                self.assertRaises(UnistorageTimeout, future.result, 2)
+                future = waiter.wait(PendingFile('/2/', {}), timeout=0.2)
+                self.assertRaises(UnistorageTimeout, future.result, 2)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.image_file = FileFactory.build_from_dict(
+            '/1/', TestFileFactory('test_ok').get_ok_image_response())
+
+    def test_actions(self):
+        base = self.image_file.pipeline().resize('keep', 50, 50)
+        pipeline = base.grayscale().rotate(90, with_low_priority=True)
+        self.assertEqual([action.name for action in base.actions], ['resize'])
+        self.assertEqual([action.name for action in pipeline.actions],
+                         ['resize', 'grayscale', 'rotate'])
+        self.assertEqual(pipeline.actions[2], Action('rotate', {'angle': 90}))
+        self.assertTrue(pipeline.actions[2].with_low_priority)
+        self.assertRaises(AttributeError, getattr, pipeline, 'apply_template')
+        self.assertRaises(AttributeError, getattr, pipeline, 'extract_audio')
+
+    def test_apply(self):
+        templates = []
+
+        def create_template(handler):
+            form = handler.form()
+            templates.append((form.getfirst('applicable_for'), form.getlist('action[]')))
+            return 200, {'resource_uri': '/template/1/'}
+
+        responses = {
+            ('POST', '/template/'): create_template,
+            ('GET', '/1/'): (200, {'resource_uri': '/2/'}),
+            ('GET', '/2/'): (200, {'status': 'wait', 'ttl': 5}),
+        }
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token') as unistorage:
+                result = self.image_file.pipeline().resize('keep', 50, 50).grayscale().apply(
+                    unistorage, with_low_priority=True)
+                self.image_file.pipeline().resize('keep', 50, 50).apply(
+                    unistorage, with_low_priority=True, lazy=True)
+        self.assertIs(type(result), PendingFile)
+        self.assertEqual(templates, [
+            ('image', ['action=resize&h=50&mode=keep&w=50', 'action=grayscale'])])
+        self.assertEqual([request[1:] for request in server.requests[1:3]], [
+            ('/1/', {'template': '/template/1/', 'with_low_priority': '1'}),
+            ('/2/', {}),
+        ])
+        self.assertEqual(server.requests[3][1:], ('/1/', {
+            'action': 'resize', 'mode': 'keep', 'w': '50', 'h': '50',
+            'with_low_priority': '1'}))
+
+
+class TestTemplateRegistry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'templates.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_create_template(self):
+        responses = {('POST', '/template/'): (200, {'resource_uri': '/template/1/'})}
+        config = {'thumbnail': {'applicable_for': 'image', 'actions': [
+            {'w': 50, 'h': 50, 'mode': 'keep', 'action': 'resize'}, {'action': 'grayscale'}]}}
+        actions = [Action('resize', {'mode': 'keep', 'w': 50, 'h': 50}), Action('grayscale')]
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token',
+                                  template_registry=TemplateRegistry(self.path)) as unistorage:
+                template = unistorage.create_template('image', actions)
+                self.assertEqual(unistorage.create_template('image', actions).resource_uri,
+                                 template.resource_uri)
+            registry = TemplateRegistry(self.path)
+            self.assertEqual(len(registry), 1)
+            with UnistorageClient(server.url, 'token', template_registry=registry) as unistorage:
+                templates = registry.preload(unistorage, config)
+                unistorage.create_template('doc', actions)
+        self.assertEqual(templates['thumbnail'].resource_uri, '/template/1/')
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(len(TemplateRegistry(self.path)), 2)
+
+
+class TestUploadIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = UploadIndex(os.path.join(self.directory, 'uploads.db'),
+                                 algorithm='sha256', max_entries=2)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_upload_file(self):
+        uploads = []
+        existing = set()
+
+        def upload(handler):
+            uploads.append(handler.form()['file'].value)
+            existing.add('/%d/' % len(uploads))
+            return 200, {'resource_uri': '/%d/' % len(uploads)}
+
+        def get_file(handler):
+            if handler.path in existing:
+                return 200, {'status': 'wait', 'ttl': 5}
+            return 404, {'msg': 'Not found'}
+
+        responses = dict([(('POST', '/'), upload)] + [
+            (('GET', '/%d/' % i), get_file) for i in range(1, 5)])
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token', upload_index=self.index) as unistorage:
+                content = StringIO('content')
+                content.read(2)
+                self.assertEqual(str(unistorage.upload_file('a.txt', content)), '/1/')
+                self.assertEqual(str(unistorage.upload_file('b.txt', 'ntent')), '/1/')
+                self.assertEqual(str(unistorage.upload_file('c.txt', 'ntent', type_id='t')), '/2/')
+                existing.remove('/1/')
+                self.assertEqual(str(unistorage.upload_file('d.txt', 'ntent')), '/3/')
+                unistorage.upload_file('e.txt', iter(['ntent']))
+                read_fd, write_fd = os.pipe()
+                os.write(write_fd, 'ntent')
+                os.close(write_fd)
+                with os.fdopen(read_fd, 'rb') as pipe:
+                    unistorage.upload_file('f.txt', pipe, lazy=True)
+                self.assertEqual(len(self.index), 2)
+                existing.remove('/2/')
+                self.assertEqual(self.index.verify(unistorage), 1)
+        self.assertEqual(uploads, ['ntent'] * 5)
+        self.assertEqual(len(self.index), 1)
+
+
+class TestDerivedFileMemo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'derived.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_apply_action(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        requests = []
+        processed = set()
+
+        def handler(request):
+            requests.append((request.path, request.params.get('action')))
+            if request.path == '/1/' and request.params:
+                return 200, {'resource_uri': '/%s/' % (
+                    request.params.get('action') or request.params['template'].strip('/'))}
+            if request.path in processed:
+                return 200, image_response
+            if request.path in ('/1/', '/grayscale/', '/t/'):
+                processed.add(request.path)
+                return 200, {'status': 'wait', 'ttl': 5}
+            return 404, {'msg': 'Not found'}
+
+        def client(memo):
+            return UnistorageClient('http://unistorage/', 'token', derived_memo=memo,
+                                    transport=InMemoryTransport(handler))
+
+        memo = DerivedFileMemo(self.path)
+        unistorage = client(memo)
+        image_file = ImageFile('/1/', image_response)
+        grayscale = Action('grayscale')
+        self.assertIs(type(unistorage.apply_action(image_file, grayscale)), PendingFile)
+        self.assertEqual(len(memo), 0)
+        self.assertIs(type(unistorage.apply_action(image_file, grayscale)), ImageFile)
+        unistorage.apply_action(image_file, Action('rotate', {'angle': 90}), lazy=True)
+        self.assertEqual(len(memo), 1)
+        memo.close()
+
+        del requests[:]
+        memo = DerivedFileMemo(self.path)
+        unistorage = client(memo)
+        self.assertIs(type(unistorage.apply_action(image_file, Action('grayscale'))), ImageFile)
+        self.assertEqual(requests, [('/grayscale/', None)])
+
+        template = Template('/t/')
+        unistorage.apply_template(image_file, template)
+        unistorage.apply_template(image_file, template, with_low_priority=True)
+        self.assertEqual(memo.get(memo.key('/1/', template=template)), '/t/')
+
+        memo.add(memo.key('/1/', action=grayscale), '/removed/')
+        self.assertEqual(str(unistorage.apply_action(image_file, grayscale)), '/grayscale/')
+        self.assertEqual(len(memo), 2)
+        memo.close()
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.memo = DerivedFileMemo(os.path.join(self.directory, 'derived.db'))
+
+    def tearDown(self):
+        self.memo.close()
+        shutil.rmtree(self.directory)
+
+    def test_prefetch_uploaded_files(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        requests = []
+
+        def handler(request):
+            requests.append((request.method, request.path, request.params))
+            if request.method == 'POST':
+                return 200, {'resource_uri': '/1/'}
+            if request.params:
+                return 200, {'resource_uri': '/r/'}
+            return 200, image_response
+
+        unistorage = UnistorageClient('http://unistorage/', 'token', derived_memo=self.memo,
+                                      transport=InMemoryTransport(handler))
+        thumbnail = Template('/t/', 'image')
+        unistorage.prefetcher = Prefetcher(unistorage, [thumbnail, Template('/d/', 'doc')])
+        image_file = unistorage.upload_file('a.jpg', 'content', lazy=True)
+        unistorage.prefetcher.join()
+        self.assertEqual(requests[2], ('GET', '/1/', {'template': '/t/', 'with_low_priority': '1'}))
+
+        del requests[:]
+        self.assertEqual(str(unistorage.apply_template(image_file, thumbnail)), '/r/')
+        self.assertEqual(requests, [('GET', '/r/', {})])
+        unistorage.close()
+        self.assertEqual(unistorage.prefetcher.stats, {
+            'submitted': 1, 'dropped': 0, 'skipped': 0, 'prefetched': 1,
+            'failed': 0, 'queued': 0})
+
+        prefetcher = Prefetcher(unistorage, [thumbnail], max_queue_size=1, workers=0)
+        self.assertTrue(prefetcher.submit(image_file))
+        self.assertFalse(prefetcher.submit(image_file))
+        self.assertFalse(prefetcher.submit(PendingFile('/2/', {'status': 'wait'})))
+        self.assertEqual((prefetcher.dropped, prefetcher.skipped), (1, 1))
+        self.assertRaises(ValueError, Prefetcher, unistorage, [Template('/t/')])
+
+    def test_transport_errors(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+
+        def handler(request):
+            if request.params:
+                raise ConnectionError('Connection refused')
+            return 200, image_response
+
+        unistorage = UnistorageClient('http://unistorage/', 'token',
+                                      transport=InMemoryTransport(handler))
+        prefetcher = Prefetcher(unistorage, [Template('/t/', 'image')], workers=1)
+        for uri in ('/1/', '/2/'):
+            self.assertTrue(prefetcher.submit(LazyFile(unistorage, uri)))
+        prefetcher.join()
+        prefetcher.close()
+        self.assertEqual((prefetcher.prefetched, prefetcher.failed), (0, 2))
+
+
+class TestRetry(unittest.TestCase):
+    def failing(self, statuses, response):
+        statuses = list(statuses)
+
+        def respond(handler):
+            if statuses:
+                return statuses.pop(0), {'msg': 'Unavailable'}, {'Retry-After': '0'}
+            return response(handler) if callable(response) else response
+        return respond
+
+    def test_retry(self):
+        uploads = []
+
+        def upload(handler):
+            uploads.append(handler.form()['file'].value)
+            return 200, {'resource_uri': '/1/'}
+
+        responses = {
+            ('GET', '/1/'): self.failing([503, 500], (200, {'status': 'wait', 'ttl': 5})),
+            ('POST', '/'): self.failing([503], upload),
+            ('POST', '/template/'): self.failing([500], (200, {'resource_uri': '/t/'})),
+        }
+        retry = RetryPolicy(total=2, backoff_factor=0.001)
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token', retry=retry) as unistorage:
+                self.assertIs(type(unistorage.get_file('/1/')), PendingFile)
+                unistorage.upload_file('a.txt', StringIO('content'), lazy=True)
+                self.assertRaises(UnistorageError, unistorage.create_template, 'image', [])
+        self.assertEqual(uploads, ['content'])
+        self.assertEqual([path for _, path, _ in server.requests],
+                         ['/1/', '/1/', '/1/', '/', '/', '/template/'])
+
+    def test_retry_policy(self):
+        retry = RetryPolicy(backoff_factor=1, max_backoff=10)
+        self.assertTrue(retry.is_retryable('get', status_code=502))
+        self.assertFalse(retry.is_retryable('post', status_code=502))
+        self.assertTrue(retry.is_retryable('post', status_code=429))
+        self.assertFalse(retry.is_retryable('get', status_code=404))
+        self.assertTrue(0 <= retry.get_backoff(2) <= 4)
+        self.assertEqual(retry.get_backoff(2, retry_after='7'), 7)
+        self.assertIsNone(retry.get_backoff(2, retry_after='60'))
+
+    def test_circuit_breaker(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10,
+                                 clock=lambda: now[0])
+        responses = {('GET', '/1/'): self.failing([500, 500, 500], (200, {'status': 'wait'}))}
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token', circuit_breaker=breaker) as unistorage:
+                for _ in range(2):
+                    self.assertRaises(UnistorageError, unistorage.get_file, '/1/')
+                self.assertRaises(UnistorageCircuitOpen, unistorage.get_file, '/1/')
+                now[0] = 10
+                self.assertRaises(UnistorageError, unistorage.get_file, '/1/')
+                self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+                now[0] = 20
+                unistorage.get_file('/1/')
+                self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(len(server.requests), 4)
+
+    def test_circuit_breaker_probe(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10,
+                                 clock=lambda: now[0])
+
+        def handler(request):
+            raise ChunkedEncodingError('Connection broken')
+
+        with UnistorageClient('http://unistorage/', 'token', circuit_breaker=breaker,
+                              transport=InMemoryTransport(handler)) as unistorage:
+            self.assertRaises(ChunkedEncodingError, unistorage.get_file, '/1/')
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            now[0] = 10
+            self.assertRaises(ChunkedEncodingError, unistorage.get_file, '/1/')
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        now[0] = 20
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        now[0] = 30
+        self.assertTrue(breaker.allow())
+
+
+class TestLimits(unittest.TestCase):
+    def test_token_bucket(self):
+        now, sleeps = [0.0], []
+        bucket = TokenBucket(10, burst=2, clock=lambda: now[0], sleep=sleeps.append)
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0, 0, 0.1])
+        now[0] = 1
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(sleeps, [0.1])
+        self.assertEqual(bucket.stats['requests'], 4)
+
+    def test_adaptive_concurrency_limit(self):
+        concurrency = AdaptiveConcurrencyLimit(initial=4, min_limit=1, max_limit=5)
+        tickets = [concurrency.acquire()[0] for _ in range(4)]
+        self.assertEqual(concurrency.stats['in_flight'], 4)
+        for ticket in tickets[:2]:
+            concurrency.release(ticket, False)
+        self.assertEqual(concurrency.stats['limit'], 2)
+        for ticket in tickets[2:]:
+            concurrency.release(ticket, True)
+        for _ in range(3):
+            concurrency.release(concurrency.acquire()[0], True)
+        stats = concurrency.stats
+        self.assertEqual((stats['limit'], stats['in_flight'], stats['queued'], stats['requests']),
+                         (3, 0, 0, 7))
+
+    def test_client(self):
+        def handler(request):
+            if request.method == 'POST':
+                return 200, {'resource_uri': '/1/'}
+            if request.path == '/1/':
+                return 200, {'status': 'wait', 'ttl': 5}
+            return 503, {'msg': 'Unavailable'}
+
+        limiter = RequestLimiter(rates={'upload': 1000, 'metadata': 1000},
+                                 concurrency=AdaptiveConcurrencyLimit(initial=8))
+        unistorage = UnistorageClient('http://unistorage/', 'token', limiter=limiter,
+                                      transport=InMemoryTransport(handler))
+        unistorage.upload_file('a.txt', 'content')
+        unistorage.get_file('/1/')
+        self.assertRaises(UnistorageError, unistorage.get_file, '/2/')
+        stats = limiter.stats
+        self.assertEqual(stats['rates']['upload']['requests'], 1)
+        self.assertEqual(stats['rates']['metadata']['requests'], 3)
+        self.assertEqual((stats['concurrency']['requests'], stats['concurrency']['limit']),
+                         (4, 4))
+
+
+class TestLoadBalancer(unittest.TestCase):
+    def dead_url(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return 'http://127.0.0.1:%d/' % port
+
+    def test_fail_over(self):
+        pending = (200, {'status': 'wait', 'ttl': 5})
+        dead_url = self.dead_url()
+        with FakeUnistorageServer({('GET', '/1/'): pending}) as healthy, \
+                FakeUnistorageServer({('GET', '/1/'): (500, {'msg': 'Error'}),
+                                      ('GET', '/'): (500, {'msg': 'Error'})}) as failing:
+            balancer = LoadBalancer([dead_url, failing.url, healthy.url], failure_threshold=1,
+                                    rng=random.Random(1))
+            with UnistorageClient(None, 'token', balancer=balancer) as unistorage:
+                self.assertEqual(unistorage.url, dead_url)
+                for _ in range(10):
+                    self.assertIs(type(unistorage.get_file('/1/')), PendingFile)
+                stats = dict((node['url'], node) for node in balancer.stats)
+                self.assertTrue(stats[dead_url]['ejected'])
+                self.assertTrue(stats[failing.url]['ejected'])
+                self.assertEqual(stats[healthy.url]['requests'], 10)
+                self.assertEqual(stats[dead_url]['requests'], 1)
+                self.assertEqual(stats[failing.url]['requests'], 1)
+
+                balancer.check_health(unistorage._check_endpoint)
+                self.assertEqual([node['ejected'] for node in balancer.stats],
+                                 [True, True, False])
+                failing.responses[('GET', '/')] = (401, {'msg': 'Unauthorized'})
+                balancer.check_health(unistorage._check_endpoint)
+                self.assertEqual([node['ejected'] for node in balancer.stats],
+                                 [True, False, False])
+        self.assertEqual(len(failing.requests), 3)
+
+    def test_latency_aware(self):
+        balancer = LoadBalancer(['http://a/', 'http://b/'], rng=random.Random(1))
+        slow, fast = balancer.endpoints
+        balancer.release(balancer.acquire(exclude=[fast]), 0.5, True)
+        balancer.release(balancer.acquire(exclude=[slow]), 0.01, True)
+        self.assertEqual([balancer.acquire() for _ in range(5)], [fast] * 5)
+        self.assertEqual(fast.in_flight, 5)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_events(self):
+        events = []
+        collector = HistogramCollector()
+        responses = {
+            ('POST', '/'): (200, {'resource_uri': '/1/'}),
+            ('GET', '/1/'): lambda handler: (
+                (200, {'resource_uri': '/2/'}) if handler.query else (200, {'status': 'wait'})),
+            ('GET', '/2/'): (200, {'status': 'wait', 'ttl': 5}),
+        }
+        with FakeUnistorageServer(responses) as server:
+            with UnistorageClient(server.url, 'token', cache=MetadataCache(),
+                                  hooks=[events.append]) as unistorage:
+                unistorage.add_hook(collector)
+                pending_file = unistorage.upload_file('a.txt', 'x' * 1000, lazy=True)
+                unistorage.apply_action(pending_file, Action('grayscale'))
+                unistorage.get_file('/2/')
+                self.assertRaises(UnistorageError, unistorage.get_file, '/3/')
+                unistorage.remove_hook(events.append)
+                unistorage.get_file('/2/')
+
+        self.assertEqual([(e.operation, e.method, e.url, e.status_code, e.cache, e.error)
+                          for e in events], [
+            ('upload_file', 'POST', '/', 200, None, None),
+            ('apply_action', 'GET', '/1/', 200, None, None),
+            ('apply_action', 'GET', '/2/', 200, 'miss', None),
+            ('get_file', 'GET', '/2/', None, 'hit', None),
+            ('get_file', 'GET', '/3/', 404, 'miss', 'UnistorageError'),
+        ])
+        self.assertGreater(events[0].bytes_sent, 1000)
+        self.assertGreater(events[1].bytes_received, 0)
+        self.assertTrue(all(e.latency >= 0 and e.retries == 0 for e in events))
+
+        hits = [group for group in collector.snapshot() if group['cache'] == 'hit']
+        self.assertEqual(len(collector.snapshot()), 5)
+        self.assertEqual(hits[0]['count'], 2)
+        self.assertEqual(hits[0]['buckets'][-1], (float('inf'), 2))
+
+    def test_failed_retries(self):
+        events, attempts = [], []
+
+        def handler(request):
+            attempts.append(request.path)
+            raise ReadTimeout()
+
+        with UnistorageClient('http://unistorage/', 'token', hooks=[events.append],
+                              retry=RetryPolicy(total=3, backoff_factor=0.001),
+                              transport=InMemoryTransport(handler)) as unistorage:
+            self.assertRaises(UnistorageTimeout, unistorage.get_file, '/1/')
+        self.assertEqual(len(attempts), 4)
+        self.assertEqual([(e.retries, e.error) for e in events], [(3, 'UnistorageTimeout')])
+
+
+class TestTransport(unittest.TestCase):
+    def test_urllib3(self):
+        uploads = []
+
+        def upload(handler):
+            form = handler.form()
+            uploads.append((form['file'].value, form.getfirst('type_id')))
+            return 200, {'resource_uri': '/1/'}
+
+        def create_template(handler):
+            uploads.append(handler.form().getlist('action[]'))
+            return 200, {'resource_uri': '/t/'}
+
+        content = 'x' * 10000
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        responses = {
+            ('POST', '/'): upload,
+            ('POST', '/template/'): create_template,
+            ('GET', '/1/'): (200, image_response),
+            ('GET', '/content'): (200, content),
+        }
+        with FakeUnistorageServer(responses) as server:
+            image_response['data'].update(url=server.url + 'content', size=len(content))
+            with UnistorageClient(server.url, 'token',
+                                  transport=Urllib3Transport()) as unistorage:
+                image_file = unistorage.upload_file('a.txt', StringIO(content), type_id='id')
+                unistorage.upload_file('b.txt', iter([content]), lazy=True)
+                unistorage.create_template('image', [Action('grayscale')])
+                self.assertEqual(unistorage.download(image_file, StringIO()), len(content))
+                self.assertRaises(UnistorageError, unistorage.get_file, '/2/')
+                stats = unistorage.connection_stats
+        self.assertIs(type(image_file), ImageFile)
+        self.assertEqual(uploads, [(content, 'id'), (content, None),
+                                   ['action=grayscale']])
+        self.assertEqual(stats, {'requests': 6, 'opened': 1, 'reused': 5})
+        self.assertEqual(server.requests[1], ('GET', '/1/', {}))
+
+    def test_in_memory(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        requests = []
+
+        def handler(request):
+            requests.append((request.method, request.path, request.params))
+            if request.path == '/slow/':
+                raise ReadTimeout()
+            if request.method == 'POST':
+                self.assertIn('content', request.body)
+                return 200, {'resource_uri': '/1/'}
+            if request.params:
+                return 200, {'resource_uri': '/2/'}
+            if request.path == '/1/':
+                return 200, image_response
+            return 404, {'msg': 'Not found'}
+
+        unistorage = UnistorageClient('http://unistorage/', 'token',
+                                      transport=InMemoryTransport(handler))
+        image_file = unistorage.upload_file('a.jpg', 'content')
+        resized = unistorage.apply_action(
+            image_file, Action('resize', {'mode': 'keep', 'w': 5, 'h': 5}), lazy=True)
+        self.assertRaises(UnistorageTimeout, unistorage.get_file, '/slow/')
+        with self.assertRaises(UnistorageError) as context:
+            unistorage.get_file('/2/')
+        self.assertEqual((context.exception.status_code, context.exception.msg),
+                         (404, 'Not found'))
+        self.assertIs(type(image_file), ImageFile)
+        self.assertEqual(str(resized), '/2/')
+        self.assertEqual(requests[2], ('GET', '/1/', {
+            'action': 'resize', 'mode': 'keep', 'w': '5', 'h': '5'}))
+        self.assertEqual(unistorage.connection_stats['requests'], 5)
+
+        received = []
+        transport = InMemoryTransport(lambda request: (received.append(request), (200, {}))[1])
+        transport.request('post', 'http://unistorage/?a=1', params={'b': 2},
+                          data={'c': [3, u'\u0444']})
+        transport.request('post', 'http://unistorage/', data={'d': 4},
+                          files={'file': ('a.txt', 'content')})
+        self.assertEqual(received[0].params, {'a': '1', 'b': '2', 'c': ['3', '\xd1\x84']})
+        self.assertEqual(received[1].params, {})
+        self.assertIn('multipart/form-data', received[1].headers['Content-Type'])
+        self.assertIn('filename="a.txt"', received[1].body)
+        self.assertRaises(TypeError, Transport)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_are_collapsed(self):
+        image_response = TestFileFactory('test_ok').get_ok_image_response()
+        requests = []
+        release = threading.Event()
+
+        def handler(request):
+            requests.append(request.path)
+            release.wait()
+            if request.path == '/1/':
+                return 200, image_response
+            return 404, {'msg': 'Not found'}
+
+        single_flight = SingleFlight()
+        unistorage = UnistorageClient('http://unistorage/', 'token',
+                                      single_flight=single_flight,
+                                      transport=InMemoryTransport(handler))
+
+        def call_concurrently(file_uri):
+            results = []
+
+            def get_file():
+                try:
+                    results.append(unistorage.get_file(file_uri))
+                except UnistorageError as e:
+                    results.append(e)
+
+            threads = [threading.Thread(target=get_file) for _ in range(5)]
+            collapsed = single_flight.collapsed
+            for thread in threads:
+                thread.start()
+            while single_flight.collapsed < collapsed + 4:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+            release.clear()
+            return results
+
+        files = call_concurrently('/1/')
+        errors = call_concurrently('/2/')
+        self.assertEqual(requests, ['/1/', '/2/'])
+        self.assertTrue(all(type(file) is ImageFile for file in files))
+        self.assertEqual(len(set(id(file) for file in files)), 5)
+        self.assertEqual([error.status_code for error in errors], [404] * 5)
+        self.assertEqual(single_flight.stats, {'calls': 10, 'collapsed': 8, 'in_flight': 0})
@@ -1,3 +1,7 @@
-from .client import UnistorageClient, UnistorageError, UnistorageTimeout
-from .models import (Action, Template, PendingFile, TemporaryFile,
-	                 RegularFile, ZipFile, ImageFile, VideoFile, AudioFile, DocFile)
+from .client import (UnistorageClient, UnistorageError, UnistorageTimeout,
+                     UnistorageCircuitOpen, UnistorageConnectionError)
+from .async_client import AsyncUnistorageClient
+from .waiter import PendingFileWaiter
+from .models import (Action, Template, Pipeline, PendingFile, TemporaryFile,
+	                 RegularFile, ZipFile, ImageFile, VideoFile, AudioFile, DocFile,
+	                 LazyFile)
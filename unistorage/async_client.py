@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from client import UnistorageClient
+
+
+class AsyncUnistorageClient(object):
+    """Non-blocking interface to the Unistorage API.
+
+    Accepts the same arguments as :class:`unistorage.client.UnistorageClient`
+    plus `max_workers` -- the number of requests that can be in flight at once
+    (defaults to the `pool_maxsize` of the connection pool). Every method
+    returns a :class:`concurrent.futures.Future` that resolves to the same
+    value the corresponding :class:`UnistorageClient` method returns.
+
+    Action methods of the models return futures too when they are called
+    with this client:
+
+    .. code-block:: python
+
+        >>> unistorage = AsyncUnistorageClient(
+        ...     'http://localhost:5000/', 'dc363e85965d461b81a4f78df45f636f')
+        >>> future = unistorage.get_file('/523d6e5a8149950ad2fba5e2/')
+        >>> image_file = future.result()
+        >>> image_file.resize(unistorage, 'crop', 50, 50)
+        <Future at 0x2b3f590 state=running>
+    """
+    def __init__(self, url, token, max_workers=None, **kwargs):
+        self.client = UnistorageClient(url, token, **kwargs)
+        self.executor = ThreadPoolExecutor(
+            max_workers or kwargs.get('pool_maxsize', 10))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Waits for the pending requests and closes all the pooled connections."""
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    def _submit(self, method, *args, **kwargs):
+        return self.executor.submit(method, *args, **kwargs)
+
+    def get_file(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.get_file`."""
+        return self._submit(self.client.get_file, *args, **kwargs)
+
+    def get_zip_file(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.get_zip_file`."""
+        return self._submit(self.client.get_zip_file, *args, **kwargs)
+
+    def download(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.download`."""
+        return self._submit(self.client.download, *args, **kwargs)
+
+    def upload_file(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.upload_file`."""
+        return self._submit(self.client.upload_file, *args, **kwargs)
+
+    def create_template(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.create_template`."""
+        return self._submit(self.client.create_template, *args, **kwargs)
+
+    def apply_action(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.apply_action`."""
+        return self._submit(self.client.apply_action, *args, **kwargs)
+
+    def apply_template(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.apply_template`."""
+        return self._submit(self.client.apply_template, *args, **kwargs)
+
+    def apply_actions(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.apply_actions`."""
+        return self._submit(self.client.apply_actions, *args, **kwargs)
+
+    def get_zipped(self, *args, **kwargs):
+        """See :meth:`UnistorageClient.get_zipped`."""
+        return self._submit(self.client.get_zipped, *args, **kwargs)
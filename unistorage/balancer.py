@@ -0,0 +1,201 @@
+import logging
+import math
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint(object):
+    """Unistorage API node known to :class:`LoadBalancer`.
+
+    .. attribute:: url
+
+        Root URL of the node.
+
+    .. attribute:: latency
+
+        Exponentially weighted moving average of the response time in seconds.
+
+    .. attribute:: in_flight
+
+        Number of requests being sent to the node.
+
+    .. attribute:: failures
+
+        Number of consecutive failed requests.
+    """
+    __slots__ = ('url', 'latency', 'in_flight', 'failures', 'requests',
+                 'ejected_until', '_updated_at')
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = 0.0
+        self.in_flight = 0
+        self.failures = 0
+        self.requests = 0
+        self.ejected_until = 0
+        self._updated_at = None
+
+    def cost(self):
+        """Expected time to serve one more request."""
+        return self.latency * (self.in_flight + 1)
+
+
+class LoadBalancer(object):
+    """Routes requests to the fastest healthy Unistorage API node.
+
+    Each request goes to the better of two randomly chosen healthy nodes
+    (power of two choices), where the better node has the lower latency
+    average multiplied by the number of its requests in flight. Latencies are
+    averaged with exponential decay over time, so a node that got slow is
+    noticed in a few requests, and a node that recovered gets its traffic back.
+
+    A node is ejected for `ejection_time` seconds after `failure_threshold`
+    consecutive failures (timeouts, connection errors and ``5xx`` responses),
+    or after a failed active health check if they are enabled. If all nodes
+    are ejected, requests are sent to all of them anyway.
+
+    :param urls: List of the root URLs of the nodes.
+    :param decay: Time in seconds over which old latencies lose weight.
+    :param failure_threshold: Number of consecutive failures that ejects a node.
+    :param ejection_time: Seconds an ejected node doesn't receive requests.
+    :param failure_penalty: Latency in seconds recorded for a failed request
+        (a node that fails fast must not look fast).
+    :param health_check_interval: Seconds between active health checks or
+        ``None`` to check nodes only passively.
+    :param health_check_path: Relative URL requested by the health checks.
+    :param health_check_timeout: Timeout of a health check in seconds.
+
+    .. code-block:: python
+
+        >>> unistorage = UnistorageClient(['http://unistorage1/', 'http://unistorage2/'], token)
+        >>> balancer = LoadBalancer(urls, health_check_interval=10)
+        >>> unistorage = UnistorageClient(None, token, balancer=balancer)
+    """
+    def __init__(self, urls, decay=10.0, failure_threshold=3, ejection_time=30,
+                 failure_penalty=1.0, health_check_interval=None,
+                 health_check_path='/', health_check_timeout=5,
+                 clock=time.time, rng=None):
+        if not urls:
+            raise ValueError('At least one URL is required.')
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.decay = decay
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.failure_penalty = failure_penalty
+        self.health_check_interval = health_check_interval
+        self.health_check_path = health_check_path
+        self.health_check_timeout = health_check_timeout
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _candidates(self, exclude):
+        now = self.clock()
+        candidates = [e for e in self.endpoints if e not in exclude]
+        healthy = [e for e in candidates if e.ejected_until <= now]
+        return healthy or candidates
+
+    def has_candidates(self, exclude=()):
+        """Returns whether there are nodes other than `exclude`."""
+        return len(exclude) < len(self.endpoints)
+
+    def acquire(self, exclude=()):
+        """Chooses the node for a request, except the nodes from `exclude`.
+        Returns :class:`Endpoint` that must be passed to :meth:`release`.
+        """
+        with self._lock:
+            candidates = self._candidates(exclude)
+            if len(candidates) > 1:
+                first, second = self.rng.sample(candidates, 2)
+                endpoint = first if first.cost() <= second.cost() else second
+            else:
+                endpoint = candidates[0]
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, latency, success):
+        """Records the outcome of the request sent to `endpoint`."""
+        with self._lock:
+            endpoint.in_flight -= 1
+            now = self.clock()
+            if not success:
+                latency = max(latency, self.failure_penalty)
+            if endpoint._updated_at is None:
+                endpoint.latency = latency
+            else:
+                weight = math.exp(-max(now - endpoint._updated_at, 0) / self.decay)
+                endpoint.latency = endpoint.latency * weight + latency * (1 - weight)
+            endpoint._updated_at = now
+            if success:
+                endpoint.failures = 0
+            else:
+                endpoint.failures += 1
+                if endpoint.failures >= self.failure_threshold:
+                    self._eject(endpoint, now)
+
+    def _eject(self, endpoint, now):
+        if endpoint.ejected_until <= now:
+            logger.warning('Unistorage node %s is ejected for %s seconds.',
+                           endpoint.url, self.ejection_time)
+        endpoint.ejected_until = now + self.ejection_time
+
+    def record_health(self, endpoint, healthy):
+        """Records the result of the active health check of `endpoint`."""
+        with self._lock:
+            if healthy:
+                endpoint.failures = 0
+                endpoint.ejected_until = 0
+            else:
+                self._eject(endpoint, self.clock())
+
+    def check_health(self, probe):
+        """Checks all the nodes with `probe`, a function that is called with
+        :class:`Endpoint` and returns whether the node is healthy.
+        """
+        for endpoint in self.endpoints:
+            self.record_health(endpoint, probe(endpoint))
+
+    def start_health_checks(self, probe):
+        """Starts a thread that calls :meth:`check_health` every
+        `health_check_interval` seconds.
+        """
+        if self.health_check_interval is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._check_periodically, args=(probe,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _check_periodically(self, probe):
+        while not self._stopped.wait(self.health_check_interval):
+            try:
+                self.check_health(probe)
+            except Exception:
+                logger.exception('Unistorage health check failed.')
+
+    def close(self):
+        """Stops the health checks."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def stats(self):
+        """List of dictionaries with the state of every node."""
+        now = self.clock()
+        with self._lock:
+            return [{
+                'url': e.url,
+                'latency': e.latency,
+                'in_flight': e.in_flight,
+                'requests': e.requests,
+                'failures': e.failures,
+                'ejected': e.ejected_until > now,
+            } for e in self.endpoints]
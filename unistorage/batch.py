@@ -0,0 +1,96 @@
+import threading
+import time
+
+from concurrency import iter_completed
+
+
+class UploadBatch(object):
+    """Iterator over the results of :meth:`UnistorageClient.upload_files`.
+    Yields ``(file_name, file)`` tuples in the order of completion; `file` is
+    the exception if the upload failed.
+
+    .. attribute:: uploaded
+
+        Number of uploaded files.
+
+    .. attribute:: failed
+
+        Number of failed uploads.
+
+    .. attribute:: bytes_sent
+
+        Number of bytes sent.
+    """
+    def __init__(self, unistorage, files, max_workers, catch, close=True, **kwargs):
+        self.unistorage = unistorage
+        self.close_files = close
+        # Called from the callback that counts the bytes sent
+        self.callback = kwargs.pop('callback', None)
+        self.kwargs = kwargs
+        self.uploaded = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._results = iter_completed(self._upload, files, max_workers,
+                                       catch=catch)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.started_at is None:
+            self.started_at = time.time()
+        try:
+            (file_name, _, _), result = next(self._results)
+        except StopIteration:
+            self.finished_at = self.finished_at or time.time()
+            raise
+        with self._lock:
+            if isinstance(result, Exception):
+                self.failed += 1
+            else:
+                self.uploaded += 1
+        return file_name, result
+
+    def _upload(self, item):
+        file_name, file_content, type_id = item
+        sent = [0]
+
+        def callback(bytes_sent, total):
+            sent[0] = bytes_sent
+            if self.callback is not None:
+                self.callback(bytes_sent, total)
+
+        try:
+            return self.unistorage.upload_file(file_name, file_content, type_id=type_id,
+                                               callback=callback, **self.kwargs)
+        finally:
+            with self._lock:
+                self.bytes_sent += sent[0]
+            if self.close_files and hasattr(file_content, 'close'):
+                file_content.close()
+
+    @property
+    def elapsed(self):
+        """Seconds since the first result was requested."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def stats(self):
+        """Dictionary with the number of ``'uploaded'`` and ``'failed'`` files,
+        ``'bytes_sent'``, ``'elapsed'`` seconds and the throughput in
+        ``'files_per_second'`` and ``'mb_per_second'``.
+        """
+        elapsed = self.elapsed
+        return {
+            'uploaded': self.uploaded,
+            'failed': self.failed,
+            'bytes_sent': self.bytes_sent,
+            'elapsed': elapsed,
+            'files_per_second': elapsed and self.uploaded / elapsed,
+            'mb_per_second': elapsed and self.bytes_sent / elapsed / 2 ** 20,
+        }
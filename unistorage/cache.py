@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MetadataCache(object):
+    """Bounded LRU cache that expires every entry after its own TTL.
+
+    :param max_size: Maximum number of entries.
+    :param max_ttl: Maximum lifetime of an entry in seconds. It is also used
+        for the entries stored without TTL.
+    :param negative_ttl: Lifetime of the negative (missing file) entries in
+        seconds. ``0`` disables negative caching.
+
+    .. attribute:: hits
+
+        Number of lookups that found a fresh entry.
+
+    .. attribute:: misses
+
+        Number of lookups that found nothing or an expired entry.
+
+    .. attribute:: evictions
+
+        Number of entries removed to keep the cache within `max_size`.
+    """
+    def __init__(self, max_size=1024, max_ttl=3600, negative_ttl=0,
+                 clock=time.time):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the value stored under `key` or ``None``."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= self.clock():
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Stores `value` under `key` for `ttl` seconds (but no more than `max_ttl`)."""
+        if ttl is None or ttl > self.max_ttl:
+            ttl = self.max_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.clock() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def set_missing(self, key, error):
+        """Stores `error` that was received while looking up `key` for
+        `negative_ttl` seconds.
+        """
+        self.set(key, error, ttl=self.negative_ttl)
+
+    def invalidate(self, key):
+        """Removes `key` from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all the entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        """Dictionary with ``'hits'``, ``'misses'``, ``'evictions'`` and ``'size'``."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+        }
@@ -1,8 +1,23 @@
+import logging
+import os
+import time
+import urllib
+from contextlib import closing
 from urlparse import urljoin
 
-import requests
-from requests.exceptions import Timeout
-from models import FileFactory, Template, ZipFile
+from requests.exceptions import ConnectionError, Timeout
+from balancer import LoadBalancer
+from batch import UploadBatch
+from concurrency import iter_completed, map_ordered
+from instrumentation import RequestEvent, current_operation, operation
+from models import Action, FileFactory, LazyFile, PendingFile, Template, ZipFile
+from multipart import MultipartEncoder
+from retry import RetryPolicy
+from transport import RequestsTransport
+from zipstream import ZipStream
+
+
+logger = logging.getLogger(__name__)
 
 
 class UnistorageError(Exception):
@@ -26,36 +41,291 @@ class UnistorageTimeout(Exception):
         return 'Unistorage API request timed out.'
 
 
+class UnistorageConnectionError(UnistorageError, ConnectionError):
+    """Client raises this when it can't connect to the Unistorage API.
+    It is also :class:`requests.exceptions.ConnectionError`.
+    """
+    def __init__(self, error):
+        UnistorageError.__init__(self, None, str(error))
+
+
+class UnistorageCircuitOpen(UnistorageError):
+    """Client raises this without sending the request when the circuit breaker
+    is open after too many consecutive failures.
+    """
+    def __init__(self):
+        super(UnistorageCircuitOpen, self).__init__(
+            None, 'Unistorage API is unavailable, circuit breaker is open.')
+
+
 class UnistorageClient(object):
     """Class that provides interface to the Unistorage API.
 
-    :param url: Unistorage API root URL.
+    :param url: Unistorage API root URL or list of the root URLs of several
+        API nodes; requests are balanced between them by
+        :class:`unistorage.balancer.LoadBalancer`.
     :param token: Access token.
+    :param pool_connections: Number of per-host connection pools to keep.
+    :param pool_maxsize: Maximum number of connections kept open to one host.
+    :param pool_block: If ``True``, no more than `pool_maxsize` connections
+        are ever opened to one host; requests wait for a free connection.
+    :param keep_alive: Whether to reuse connections between requests.
+    :param cache: Optional :class:`unistorage.cache.MetadataCache` for the
+        results of :meth:`get_file`. Entries expire after the TTL returned by
+        the Unistorage API.
+    :param template_registry: Optional :class:`unistorage.templates.TemplateRegistry`
+        that keeps the templates created by :meth:`create_template`.
+    :param upload_index: Optional :class:`unistorage.dedup.UploadIndex`;
+        :meth:`upload_file` returns the existing file instead of uploading
+        the content that was already uploaded.
+    :param retry: Optional :class:`unistorage.retry.RetryPolicy`. Without it
+        failed requests are not retried.
+    :param circuit_breaker: Optional :class:`unistorage.retry.CircuitBreaker`.
+        While it is open, methods raise :class:`UnistorageCircuitOpen`
+        without sending requests.
+    :param hooks: List of functions that are called with
+        :class:`unistorage.instrumentation.RequestEvent` after every request.
+    :param derived_memo: Optional :class:`unistorage.memo.DerivedFileMemo`;
+        :meth:`apply_action` and :meth:`apply_template` return the memoized
+        derived files without asking the server.
+    :param limiter: Optional :class:`unistorage.limits.RequestLimiter` that
+        limits the rate of the requests per operation class and the number
+        of requests in flight.
+    :param single_flight: Optional :class:`unistorage.singleflight.SingleFlight`;
+        concurrent identical ``GET`` requests share a single request and
+        its result.
+    :param balancer: :class:`unistorage.balancer.LoadBalancer` of the API nodes
+        to be used instead of `url`.
+    :param transport: :class:`unistorage.transport.Transport` that sends
+        the requests. Defaults to :class:`unistorage.transport.RequestsTransport`
+        created with the pool parameters above.
+
+    The client owns a pool of HTTP connections that is reused by all the calls.
+    A single client can be shared between threads. Call :meth:`close` (or use
+    the client as a context manager) to release the connections.
 
     .. code-block:: python
 
         unistorage = UnistorageClient(
             'http://localhost:5000/', 'dc363e85965d461b81a4f78df45f636f')
 
+        with UnistorageClient('http://localhost:5000/', token,
+                              pool_maxsize=20, pool_block=True) as unistorage:
+            unistorage.get_file('/523d6e5a8149950ad2fba5e2/')
+
     .. note::
 
         All methods can raise :class:`UnistorageError` and :class:`UnistorageTimeout`.
     """
-    def __init__(self, url, token):
+    def __init__(self, url, token, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, keep_alive=True, cache=None,
+                 template_registry=None, upload_index=None, retry=None,
+                 circuit_breaker=None, hooks=None, derived_memo=None,
+                 limiter=None, single_flight=None, balancer=None, transport=None):
+        if balancer is None and not isinstance(url, basestring):
+            balancer = LoadBalancer(url)
+        self.balancer = balancer
+        if balancer is not None:
+            url = balancer.endpoints[0].url
         self.url = url
         self.token = token
+        self.cache = cache
+        self.template_registry = template_registry
+        self.upload_index = upload_index
+        self.retry = retry
+        self.circuit_breaker = circuit_breaker
+        self.hooks = list(hooks or [])
+        self.derived_memo = derived_memo
+        self.limiter = limiter
+        self.single_flight = single_flight
+        #: Optional :class:`unistorage.prefetch.Prefetcher` that receives
+        #: the uploaded files.
+        self.prefetcher = None
+        self.pool_maxsize = pool_maxsize
+        if transport is None:
+            transport = RequestsTransport(pool_connections=pool_connections,
+                                          pool_maxsize=pool_maxsize,
+                                          pool_block=pool_block,
+                                          keep_alive=keep_alive)
+        self.transport = transport
+        if balancer is not None:
+            balancer.start_health_checks(self._check_endpoint)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stops the prefetcher and the health checks and closes all the pooled
+        connections.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.balancer is not None:
+            self.balancer.close()
+        self.transport.close()
+
+    @property
+    def connection_stats(self):
+        """Dictionary with the number of ``'requests'`` sent, connections
+        ``'opened'`` and requests that ``'reused'`` an open connection.
+        """
+        return self.transport.stats.to_dict()
+
+    def add_hook(self, hook):
+        """Registers `hook` to be called with :class:`unistorage.instrumentation.RequestEvent`
+        after every request. See :class:`unistorage.instrumentation.HistogramCollector`.
+        """
+        self.hooks = self.hooks + [hook]
+
+    def remove_hook(self, hook):
+        self.hooks = [h for h in self.hooks if h != hook]
+
+    def _emit(self, event):
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception('Unistorage instrumentation hook failed.')
 
-    def _request(self, method, url, **kwargs):
+    def _request(self, method, url, cache=None, **kwargs):
         """Sends request by specified `method` to the relative `url`; adds Token header.
-        `kwargs` has the same meaning as in the requests library.
+        `kwargs` are passed to :meth:`unistorage.transport.Transport.request`.
+        Retries the request according to the retry policy.
+
+        :param cache: Cache outcome to be reported to the hooks.
         """
         kwargs.setdefault('headers', {})
         kwargs['headers'].update({'Token': self.token})
+        if not self.hooks:
+            return self._send(method, url, None, kwargs)
+
+        event = RequestEvent(current_operation(), method.upper(), url, cache=cache)
+        started_at = time.time()
         try:
-            response = requests.request(method, urljoin(self.url, url), **kwargs)
-        except Timeout:
-            raise UnistorageTimeout()
-        
+            return self._send(method, url, event, kwargs)
+        except Exception as e:
+            event.error = type(e).__name__
+            raise
+        finally:
+            event.latency = time.time() - started_at
+            event.bytes_sent = _body_size(kwargs.get('data'))
+            self._emit(event)
+
+    def _send(self, method, url, event, kwargs):
+        retries = 0
+        tried = set()
+        while True:
+            if event is not None:
+                event.retries = retries
+            if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+                raise UnistorageCircuitOpen()
+            endpoint = None
+            if self.balancer is not None:
+                endpoint = self.balancer.acquire(exclude=tried)
+            try:
+                response = self._attempt(method, url, endpoint, kwargs)
+            except (Timeout, ConnectionError) as e:
+                self._record_outcome(False)
+                if self._fail_over(method, endpoint, tried):
+                    continue
+                delay = self._get_retry_delay(method, retries, kwargs, error=e)
+                if delay is None:
+                    if isinstance(e, Timeout):
+                        raise UnistorageTimeout()
+                    raise UnistorageConnectionError(e)
+            except Exception:
+                self._record_outcome(False)
+                raise
+            else:
+                if event is not None:
+                    event.status_code = response.status_code
+                    event.bytes_received = len(response.content)
+                self._record_outcome(response.status_code < 500)
+                if response.status_code >= 500 and self._fail_over(method, endpoint, tried):
+                    continue
+                delay = self._get_retry_delay(
+                    method, retries, kwargs, status_code=response.status_code,
+                    retry_after=response.headers.get('Retry-After'))
+                if delay is None:
+                    return self._parse_response(response)
+            retries += 1
+            tried.clear()
+            time.sleep(delay)
+
+    def _attempt(self, method, url, endpoint, kwargs):
+        """Sends the request to the relative `url` of the `endpoint` (or of
+        the root URL if there is no balancer).
+        """
+        if endpoint is None:
+            return self._transport_request(method, urljoin(self.url, url), kwargs)
+        started_at = time.time()
+        success = False
+        try:
+            response = self._transport_request(method, urljoin(endpoint.url, url), kwargs)
+            success = response.status_code < 500
+            return response
+        finally:
+            self.balancer.release(endpoint, time.time() - started_at, success)
+
+    def _fail_over(self, method, endpoint, tried):
+        """Returns whether the idempotent request that failed on `endpoint`
+        should be sent to another node right away.
+        """
+        if endpoint is None or method.upper() not in RetryPolicy.idempotent_methods:
+            return False
+        tried.add(endpoint)
+        return self.balancer.has_candidates(exclude=tried)
+
+    def _check_endpoint(self, endpoint):
+        """Health check of the API node."""
+        try:
+            response = self.transport.request(
+                'get', urljoin(endpoint.url, self.balancer.health_check_path),
+                headers={'Token': self.token},
+                timeout=self.balancer.health_check_timeout)
+        except (Timeout, ConnectionError):
+            return False
+        return response.status_code < 500
+
+    def _transport_request(self, method, url, kwargs):
+        """Sends request through the transport within the limits of the limiter."""
+        if self.limiter is None:
+            return self.transport.request(method, url, **kwargs)
+        ticket = self.limiter.acquire(current_operation(), method, kwargs.get('params'))
+        success = False
+        try:
+            response = self.transport.request(method, url, **kwargs)
+            success = response.status_code < 500 and response.status_code != 429
+            return response
+        finally:
+            self.limiter.release(ticket, success)
+
+    def _record_outcome(self, success):
+        if self.circuit_breaker is not None:
+            if success:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+
+    def _get_retry_delay(self, method, retries, kwargs, status_code=None,
+                         error=None, retry_after=None):
+        """Returns delay before the next attempt or ``None`` if the request
+        must not be retried.
+        """
+        retry = self.retry
+        if retry is None or retries >= retry.total or \
+                not retry.is_retryable(method, status_code=status_code, error=error):
+            return None
+        delay = retry.get_backoff(retries, retry_after)
+        body = kwargs.get('data')
+        if delay is not None and hasattr(body, 'rewind') and not body.rewind():
+            return None
+        return delay
+
+    def _parse_response(self, response):
         status_code = response.status_code
         try:
             json = response.json()
@@ -69,36 +339,92 @@ class UnistorageClient(object):
             msg = json and json.get('msg') or response.content
             raise UnistorageError(status_code, msg)
 
-    def _get(self, url, data=None):
+    def _get(self, url, data=None, cache=None):
         """Sends a GET request. Returns the response dictionary.
         
         :param url: Relative URL.
         :param data: Dictionary to be sent in the query string.
+        :param cache: Cache outcome to be reported to the hooks.
         """
-        return self._request('get', url, params=data)
+        if self.single_flight is None:
+            return self._request('get', url, params=data, cache=cache)
+        key = ('GET', url, urllib.urlencode(sorted((data or {}).items()), doseq=True))
+        return self.single_flight.do(key, self._request, 'get', url,
+                                     params=data, cache=cache)
     
-    def _post(self, url, data=None, files=None, timeout=None):
+    def _post(self, url, data=None, files=None, timeout=None, headers=None):
         """Sends a POST request. Returns the response dictionary.
         
         :param url: Relative URL.
-        :param data: Dictionary to be sent in the body of request.
+        :param data: Dictionary or streamed body to be sent in the body of request.
         :param files: Dictionary of the files for multipart encoding upload.
         :param timeout: Integer value that define request timeout in seconds.
             It passed directly to the `requests <http://docs.python-requests.org/>`_ library.
             See requests documentation for details:
             http://docs.python-requests.org/en/latest/user/quickstart/#post-a-multipart-encoded-file
+        :param headers: Dictionary of additional headers.
         """
         return self._request('post', url, data=data, files=files,
-                             timeout=timeout)
+                             timeout=timeout, headers=headers or {})
 
+    @operation('get_file')
     def get_file(self, file_uri):
         """Retrieves data from Unistorage and returns :class:`unistorage.models.File`.
         
         :param resource_uri: File URI.
         """
-        file_response = self._get(file_uri)
-        return FileFactory.build_from_dict(file_uri, file_response)
+        if self.cache is None:
+            return FileFactory.build_from_dict(file_uri, self._get(file_uri))
+
+        file = self.cache.get(file_uri)
+        if file is not None and self.hooks:
+            event = RequestEvent(current_operation(), 'GET', file_uri, cache='hit')
+            event.error = isinstance(file, UnistorageError) and type(file).__name__ or None
+            self._emit(event)
+        if isinstance(file, UnistorageError):
+            raise file
+        elif file is None:
+            try:
+                file_response = self._get(file_uri, cache='miss')
+            except UnistorageError as e:
+                if e.status_code == 404:
+                    self.cache.set_missing(file_uri, e)
+                raise
+            file = FileFactory.build_from_dict(file_uri, file_response)
+            self.cache.set(file_uri, file, ttl=file_response.get('ttl'))
+        return file
     
+    def get_files(self, file_uris, max_workers=None):
+        """Retrieves files concurrently. Returns list of :class:`unistorage.models.File`
+        in the order of `file_uris`. If a file can't be retrieved, the list contains
+        :class:`UnistorageError` (:class:`UnistorageConnectionError` if the API
+        is unreachable) or :class:`UnistorageTimeout` in its place.
+
+        :param file_uris: List of file URIs.
+        :param max_workers: Maximum number of simultaneous requests.
+            Defaults to the size of the connection pool.
+        """
+        return map_ordered(self.get_file, file_uris,
+                           max_workers or self.pool_maxsize,
+                           catch=(UnistorageError, UnistorageTimeout))
+
+    def iter_files(self, file_uris, max_workers=None):
+        """Retrieves files concurrently. Yields ``(file_uri, file)`` tuples in
+        the order of completion; `file` is :class:`UnistorageError` or
+        :class:`UnistorageTimeout` if it can't be retrieved.
+
+        `file_uris` can be an iterator: only `max_workers` of them are consumed
+        at a time.
+
+        :param file_uris: Iterable of file URIs.
+        :param max_workers: Maximum number of simultaneous requests.
+            Defaults to the size of the connection pool.
+        """
+        return iter_completed(self.get_file, file_uris,
+                              max_workers or self.pool_maxsize,
+                              catch=(UnistorageError, UnistorageTimeout))
+
+    @operation('get_zip_file')
     def get_zip_file(self, zip_uri):
         """Retrieves data from Unistorage and returns :class:`unistorage.models.ZipFile`.
         
@@ -107,13 +433,110 @@ class UnistorageClient(object):
         zip_response = self._get(zip_uri)
         return ZipFile(zip_uri, zip_response)
 
-    def upload_file(self, file_name, file_content, type_id=None, timeout=None):
+    def iter_content(self, file, chunk_size=65536, start=0, end=None, timeout=None):
+        """Downloads binary content of the `file` using the pooled connections.
+        Yields strings of at most `chunk_size` bytes.
+
+        :param file: :class:`unistorage.models.RegularFile`,
+            :class:`unistorage.models.TemporaryFile` or :class:`unistorage.models.ZipFile`.
+        :param chunk_size: Number of bytes to read at once.
+        :param start: Offset of the first byte to download.
+        :param end: Offset of the last byte to download (inclusive).
+        :param timeout: Integer value that define request timeout in seconds.
+
+        Raises :class:`UnistorageTimeout` or :class:`UnistorageConnectionError`
+        if the download fails, also in the middle of the content.
+
+        .. code-block:: python
+
+            >>> header = ''.join(unistorage.iter_content(image_file, end=1023))
+        """
+        headers = {}
+        if start or end is not None:
+            headers['Range'] = 'bytes=%d-%s' % (start, '' if end is None else end)
+        try:
+            response = self.transport.request('get', file.url, headers=headers,
+                                              stream=True, timeout=timeout)
+            with closing(response):
+                if response.status_code >= 400:
+                    raise UnistorageError(response.status_code, response.reason)
+                # The server may ignore the Range header and send the whole content
+                skip = start if response.status_code != 206 else 0
+                left = end - start + 1 if end is not None else None
+                for chunk in response.iter_content(chunk_size):
+                    if skip:
+                        chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                    if left is not None:
+                        chunk = chunk[:left]
+                        left -= len(chunk)
+                    if chunk:
+                        yield chunk
+                    if left == 0:
+                        break
+        except Timeout:
+            raise UnistorageTimeout()
+        except ConnectionError as e:
+            raise UnistorageConnectionError(e)
+
+    def download(self, file, dest, chunk_size=65536, resume=False, timeout=None):
+        """Downloads binary content of the `file` to `dest`. Returns the size of
+        the content. Raises :class:`UnistorageError` if the size differs from
+        :attr:`RegularFile.size <unistorage.models.RegularFile.size>`.
+
+        :param file: :class:`unistorage.models.RegularFile`,
+            :class:`unistorage.models.TemporaryFile` or :class:`unistorage.models.ZipFile`.
+        :param dest: Path or writable file-like object.
+        :param chunk_size: Number of bytes to read and write at once.
+        :param resume: Whether to continue an interrupted download: only the bytes
+            after the end of the existing `dest` file (or after the current
+            position of the file-like object) are downloaded.
+        :param timeout: Integer value that define request timeout in seconds.
+
+        .. code-block:: python
+
+            >>> unistorage.download(video_file, '/tmp/video.ogv', resume=True)
+            104857600
+        """
+        if isinstance(dest, basestring):
+            start = resume and os.path.exists(dest) and os.path.getsize(dest) or 0
+            with open(dest, start and 'ab' or 'wb') as f:
+                return self._download(file, f, start, chunk_size, timeout)
+        start = resume and dest.tell() or 0
+        return self._download(file, dest, start, chunk_size, timeout)
+
+    def _download(self, file, dest, start, chunk_size, timeout):
+        expected_size = getattr(file, 'size', None)
+        size = start
+        if expected_size is None or start < expected_size:
+            for chunk in self.iter_content(file, chunk_size=chunk_size,
+                                           start=start, timeout=timeout):
+                dest.write(chunk)
+                size += len(chunk)
+        if expected_size is not None and size != expected_size:
+            raise UnistorageError(None, 'Downloaded %d bytes instead of %d.' % (
+                size, expected_size))
+        return size
+
+    @operation('upload_file')
+    def upload_file(self, file_name, file_content, type_id=None, timeout=None,
+                    callback=None, chunk_size=65536, lazy=False):
         """Uploads file to the Unistorage. Returns :class:`unistorage.models.File`.
+
+        The request body is streamed in chunks of `chunk_size` bytes, so memory
+        usage doesn't depend on the file size. If the size of `file_content`
+        can't be determined (e.g. it is a generator), the chunked transfer
+        encoding is used.
         
         :param file_name: File name.
-        :param file_content: File-like object to be uploaded.
+        :param file_content: File-like object, string or iterable of strings
+            to be uploaded.
         :param type_id: Type identifier.
         :param timeout: Integer value that define request timeout in seconds.
+        :param callback: Function that is called with the number of bytes sent
+            and the total size of the request body (or ``None``).
+        :param chunk_size: Number of bytes read from `file_content` at once.
+        :param lazy: Whether to return :class:`unistorage.models.LazyFile`
+            instead of retrieving the uploaded file.
         :rtype: :class:`unistorage.models.File`
 
         .. code-block:: python
@@ -122,14 +545,64 @@ class UnistorageClient(object):
             >>> unistorage.upload_file('jpg.jpg', file, type_id='bubu')
             <models.ImageFile object at 0x13edf10>
         """
-        data = type_id and {'type_id': type_id} or None
-        files = {'file': (file_name, file_content)}
-        upload_response = self._post('/', data=data, files=files,
-                                     timeout=timeout)
-        return self.get_file(upload_response['resource_uri'])
+        index_key = None
+        if self.upload_index is not None:
+            index_key = self.upload_index.key(file_content, type_id)
+            resource_uri = index_key and self.upload_index.get(index_key)
+            if resource_uri:
+                try:
+                    return self._get_result(resource_uri, lazy)
+                except UnistorageError as e:
+                    if e.status_code != 404:
+                        raise
+                    self.upload_index.remove(index_key)
+
+        fields = type_id and [('type_id', type_id)] or []
+        body = MultipartEncoder(fields, file_name, file_content,
+                                chunk_size=chunk_size, callback=callback)
+        upload_response = self._post('/', data=body, timeout=timeout,
+                                     headers={'Content-Type': body.content_type})
+        resource_uri = upload_response['resource_uri']
+        if index_key is not None:
+            self.upload_index.add(index_key, resource_uri)
+        result = self._get_result(resource_uri, lazy)
+        if self.prefetcher is not None:
+            self.prefetcher.submit(result)
+        return result
+
+    def upload_files(self, files, max_workers=None, close=True, **kwargs):
+        """Uploads files concurrently. Returns :class:`unistorage.batch.UploadBatch`
+        that yields ``(file_name, file)`` tuples as the uploads complete and
+        keeps the throughput statistics. A failed upload doesn't stop the
+        others: the exception is yielded in place of the file.
+
+        Only `max_workers` items are taken from `files` at a time, so it can be
+        a generator that opens the files lazily.
+
+        :param files: Iterable of ``(file_name, file_content, type_id)`` tuples.
+        :param max_workers: Maximum number of simultaneous uploads.
+            Defaults to the size of the connection pool.
+        :param close: Whether to close every file after its upload.
+        :param kwargs: Other arguments of :meth:`upload_file`.
+
+        .. code-block:: python
+
+            >>> files = ((name, open(name, 'rb'), 'qwerty') for name in names)
+            >>> batch = unistorage.upload_files(files, max_workers=8)
+            >>> for name, file in batch:
+            ...     print name, file
+            >>> batch.stats['mb_per_second']
+            42.3
+        """
+        return UploadBatch(self, files, max_workers or self.pool_maxsize,
+                           catch=(UnistorageError, UnistorageTimeout, EnvironmentError),
+                           close=close, **kwargs)
 
+    @operation('create_template')
     def create_template(self, applicable_for, actions):
         """Creates template. Returns :class:`unistorage.models.Template`.
+        If the client has a template registry and the same template is
+        already registered, it is returned without a request.
         
         :param applicable_for: Files type for that template can be applied.
             Supported types: ``'image'``, ``'video'``, ``'doc'``.
@@ -145,44 +618,168 @@ class UnistorageClient(object):
             ... ])
             <models.Template object at 0x19a5910>
         """
+        if self.template_registry is not None:
+            template = self.template_registry.get(applicable_for, actions)
+            if template is not None:
+                return template
+
         encoded_actions = [action.encode() for action in actions]
         response = self._post('/template/', data={
             'applicable_for': applicable_for,
             'action[]': encoded_actions
         })
-        return Template(response['resource_uri'])
-
-    def apply_action(self, file, action):
+        template = Template(response['resource_uri'], applicable_for)
+        if self.template_registry is not None:
+            self.template_registry.add(applicable_for, actions, template)
+        return template
+
+    def _get_result(self, resulting_file_uri, lazy):
+        if lazy:
+            return LazyFile(self, resulting_file_uri)
+        return self.get_file(resulting_file_uri)
+
+    @operation('apply_action')
+    def apply_action(self, file, action, lazy=False):
         """Applies `action` to the `file`.
 
         :param file: Source file.
         :type file: :class:`unistorage.models.File`
-        :param action: Action to be applied.
+        :param action: Action to be applied. It is applied with low priority
+            if its `with_low_priority` is set.
         :type action: :class:`unistorage.models.Action`
+        :param lazy: Whether to return :class:`unistorage.models.LazyFile`
+            instead of retrieving the resulting file.
         :rtype: :class:`unistorage.models.File`
         """
-        action_response = self._get(file.resource_uri, data=action.to_dict())
-        resulting_file_uri = action_response['resource_uri']
-        file_response = self._get(resulting_file_uri)
-        return FileFactory.build_from_dict(resulting_file_uri, file_response)
+        data = action.to_dict()
+        if action.with_low_priority:
+            data['with_low_priority'] = '1'
+        memo_key = None
+        if self.derived_memo is not None:
+            memo_key = self.derived_memo.key(file.resource_uri, action=action)
+        return self._apply(file, data, memo_key, lazy)
 
-    def apply_template(self, file, template, with_low_priority=False):
+    @operation('apply_template')
+    def apply_template(self, file, template, with_low_priority=False, lazy=False):
         """Applies `template` to the `file`.
 
         :param file: Source file.
         :type file: :class:`unistorage.models.File`
         :param template: Template to be applied.
         :type template: :class:`unistorage.models.Template`
+        :param lazy: Whether to return :class:`unistorage.models.LazyFile`
+            instead of retrieving the resulting file.
         :rtype: :class:`unistorage.models.File`
         """
         data = {'template': template.resource_uri}
         if with_low_priority:
             data['with_low_priority'] = '1'
-        template_response = self._get(file.resource_uri, data=data)
-        resulting_file_uri = template_response['resource_uri']
-        file_response = self._get(resulting_file_uri)
-        return FileFactory.build_from_dict(resulting_file_uri, file_response)
+        memo_key = None
+        if self.derived_memo is not None:
+            memo_key = self.derived_memo.key(file.resource_uri, template=template)
+        return self._apply(file, data, memo_key, lazy)
+
+    def _apply(self, file, data, memo_key, lazy):
+        """Sends the action or template request and returns the resulting file.
+        Consults the derived file memo if `memo_key` is given.
+        """
+        if memo_key is not None:
+            resource_uri = self.derived_memo.get(memo_key)
+            if resource_uri:
+                try:
+                    return self._get_result(resource_uri, lazy)
+                except UnistorageError as e:
+                    if e.status_code != 404:
+                        raise
+                    self.derived_memo.remove(memo_key)
+
+        resource_uri = self._get(file.resource_uri, data=data)['resource_uri']
+        result = self._get_result(resource_uri, lazy)
+        if memo_key is not None and not isinstance(result, (LazyFile, PendingFile)):
+            self.derived_memo.add(memo_key, resource_uri)
+        return result
+
+    @operation('apply_actions')
+    def apply_actions(self, file, actions, with_low_priority=False, lazy=False):
+        """Applies the chain of `actions` to the `file`. The chain is applied as
+        a single template, so no intermediate files are created. Files that
+        templates can't be applied to get the actions one by one.
+
+        :param file: Source file.
+        :type file: :class:`unistorage.models.File`
+        :param actions: List of :class:`unistorage.models.Action`.
+        :param with_low_priority: Whether to apply the chain with low priority.
+        :param lazy: Whether to return :class:`unistorage.models.LazyFile`
+            instead of retrieving the resulting file.
+        :rtype: :class:`unistorage.models.File`
+        """
+        if not actions:
+            return file
+        applicable_for = getattr(file, 'applicable_for', None)
+        if len(actions) == 1 or applicable_for is None:
+            if with_low_priority:
+                actions = [action if action.with_low_priority else
+                           Action(action.name, action, with_low_priority=True)
+                           for action in actions]
+            for action in actions[:-1]:
+                file = self.apply_action(file, action, lazy=True)
+            return self.apply_action(file, actions[-1], lazy=lazy)
+        template = self.create_template(applicable_for, actions)
+        return self.apply_template(file, template,
+                                   with_low_priority=with_low_priority, lazy=lazy)
+
+    def apply_action_many(self, files, action, with_low_priority=False, lazy=False,
+                          max_workers=None):
+        """Applies `action` to every file concurrently. Returns list of the
+        resulting files in the order of `files`: files that are still being
+        processed are :class:`unistorage.models.PendingFile`, and if the action
+        can't be applied to a file, the list contains :class:`UnistorageError`
+        or :class:`UnistorageTimeout` in its place.
+
+        :param files: List of :class:`unistorage.models.File`.
+        :param action: :class:`unistorage.models.Action` to be applied.
+        :param with_low_priority: Whether to apply the action with low priority
+            (as if its `with_low_priority` were set).
+        :param lazy: Whether to return :class:`unistorage.models.LazyFile`
+            instead of retrieving the resulting files. It halves the number
+            of requests.
+        :param max_workers: Maximum number of simultaneous requests.
+            Defaults to the size of the connection pool.
+        """
+        if with_low_priority and not action.with_low_priority:
+            action = Action(action.name, action, with_low_priority=True)
+        return map_ordered(lambda file: self.apply_action(file, action, lazy=lazy),
+                           files, max_workers or self.pool_maxsize,
+                           catch=(UnistorageError, UnistorageTimeout))
+
+    def apply_template_many(self, files, template, with_low_priority=False,
+                            lazy=False, max_workers=None):
+        """Applies `template` to every file concurrently. Returns list of the
+        resulting files in the order of `files`, as :meth:`apply_action_many` does.
+
+        :param files: List of :class:`unistorage.models.File`.
+        :param template: :class:`unistorage.models.Template` to be applied.
+        :param lazy: Whether to return :class:`unistorage.models.LazyFile`
+            instead of retrieving the resulting files. It halves the number
+            of requests.
+        :param max_workers: Maximum number of simultaneous requests.
+            Defaults to the size of the connection pool.
+
+        .. code-block:: python
+
+            >>> watermark = unistorage.create_template('image', [
+            ...     Action('watermark', {'watermark': '/523d6e5a8149950ad2fba5e2/'})])
+            >>> album = unistorage.get_files(uris)
+            >>> unistorage.apply_template_many(album, watermark, with_low_priority=True)
+            [<models.ImageFile object at 0x13edf10>, <models.PendingFile object at 0x13ee150>]
+        """
+        return map_ordered(
+            lambda file: self.apply_template(file, template, lazy=lazy,
+                                             with_low_priority=with_low_priority),
+            files, max_workers or self.pool_maxsize,
+            catch=(UnistorageError, UnistorageTimeout))
 
+    @operation('get_zipped')
     def get_zipped(self, zip_file_name, files):
         """Creates ZIP archive.
 
@@ -204,3 +801,41 @@ class UnistorageClient(object):
             'filename': zip_file_name
         })
         return self.get_zip_file(response['resource_uri'])
+
+    def stream_zipped(self, files, dest=None, max_workers=None, **kwargs):
+        """Assembles ZIP archive of `files` on the client instead of the server.
+        The members are downloaded concurrently and the archive is streamed
+        with constant memory usage (see :class:`unistorage.zipstream.ZipStream`).
+
+        Returns the size of the archive written to `dest`, or
+        :class:`unistorage.zipstream.ZipStream` that yields the chunks of
+        the archive if `dest` is ``None``.
+
+        :param files: Iterable of :class:`unistorage.models.RegularFile`.
+        :param dest: Writable file-like object.
+        :param max_workers: Maximum number of simultaneous downloads.
+            Defaults to the size of the connection pool.
+        :param kwargs: Other arguments of :class:`unistorage.zipstream.ZipStream`.
+
+        .. code-block:: python
+
+            >>> with open('/tmp/files.zip', 'wb') as f:
+            ...     unistorage.stream_zipped([file1, file2], f)
+            52428800
+        """
+        stream = ZipStream(self, files, max_workers=max_workers or self.pool_maxsize,
+                           **kwargs)
+        if dest is None:
+            return stream
+        return stream.write_to(dest)
+
+
+def _body_size(body):
+    """Returns the number of bytes in the request `body`."""
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body)
+    if isinstance(body, dict):
+        return len(urllib.urlencode(body, doseq=True))
+    return getattr(body, 'bytes_read', 0)
@@ -0,0 +1,133 @@
+import struct
+
+
+VERSION = 1
+
+NONE = 0
+TRUE = 1
+FALSE = 2
+INT = 3
+FLOAT = 4
+BYTES = 5
+UNICODE = 6
+REFERENCE = 7
+
+
+class CompactError(ValueError):
+    """Raised when the data can't be decoded."""
+
+
+class Encoder(object):
+    """Encodes values (``None``, booleans, integers, floats and strings) in
+    the compact binary format: the format version followed by the values,
+    each prefixed by a type tag. Integers are zigzag varints; strings are
+    varint length and bytes. A string that already occurred in the message is
+    encoded as a reference to it, so lists of files with the same MIME types
+    stay small.
+    """
+    def __init__(self):
+        self._chunks = [chr(VERSION)]
+        self._strings = {}
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+    def write_uint(self, value):
+        chunks = self._chunks
+        while value > 0x7F:
+            chunks.append(chr(value & 0x7F | 0x80))
+            value >>= 7
+        chunks.append(chr(value))
+
+    def write(self, value):
+        chunks = self._chunks
+        if value is None:
+            chunks.append(chr(NONE))
+        elif value is True:
+            chunks.append(chr(TRUE))
+        elif value is False:
+            chunks.append(chr(FALSE))
+        elif isinstance(value, (int, long)):
+            chunks.append(chr(INT))
+            self.write_uint(value << 1 if value >= 0 else (-value << 1) - 1)
+        elif isinstance(value, float):
+            chunks.append(chr(FLOAT) + struct.pack('<d', value))
+        elif isinstance(value, basestring):
+            key = (type(value), value)
+            index = self._strings.get(key)
+            if index is not None:
+                chunks.append(chr(REFERENCE))
+                self.write_uint(index)
+                return
+            self._strings[key] = len(self._strings)
+            if isinstance(value, unicode):
+                chunks.append(chr(UNICODE))
+                value = value.encode('utf-8')
+            else:
+                chunks.append(chr(BYTES))
+            self.write_uint(len(value))
+            chunks.append(value)
+        else:
+            raise TypeError('Value of type %s can\'t be encoded.' % type(value).__name__)
+
+
+class Decoder(object):
+    """Decodes values written by :class:`Encoder`."""
+    def __init__(self, data):
+        if not data or ord(data[0]) != VERSION:
+            raise CompactError('Unsupported version of the compact encoding.')
+        self._data = data
+        self._position = 1
+        self._strings = []
+
+    def at_end(self):
+        return self._position >= len(self._data)
+
+    def read_uint(self):
+        data, position = self._data, self._position
+        result = shift = 0
+        try:
+            while True:
+                byte = ord(data[position])
+                position += 1
+                result |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+        except IndexError:
+            raise CompactError('Unexpected end of the data.')
+        self._position = position
+        return result
+
+    def _read_bytes(self, length):
+        start = self._position
+        self._position += length
+        if self._position > len(self._data):
+            raise CompactError('Unexpected end of the data.')
+        return self._data[start:self._position]
+
+    def read(self):
+        tag = ord(self._read_bytes(1))
+        if tag == NONE:
+            return None
+        elif tag == TRUE:
+            return True
+        elif tag == FALSE:
+            return False
+        elif tag == INT:
+            value = self.read_uint()
+            return -((value + 1) >> 1) if value & 1 else value >> 1
+        elif tag == FLOAT:
+            return struct.unpack('<d', self._read_bytes(8))[0]
+        elif tag in (BYTES, UNICODE):
+            value = self._read_bytes(self.read_uint())
+            if tag == UNICODE:
+                value = value.decode('utf-8')
+            self._strings.append(value)
+            return value
+        elif tag == REFERENCE:
+            try:
+                return self._strings[self.read_uint()]
+            except IndexError:
+                raise CompactError('Invalid string reference.')
+        raise CompactError('Unknown type tag %d.' % tag)
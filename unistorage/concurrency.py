@@ -0,0 +1,76 @@
+from collections import deque
+from itertools import islice
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def iter_completed(func, items, max_workers, catch=()):
+    """Calls `func` for every item of `items` using `max_workers` threads.
+    Yields ``(item, result)`` tuples in completion order.
+
+    No more than `max_workers` items are taken from `items` at once, so it can
+    be a (lazy) iterator of any length. Exceptions of the `catch` types are
+    yielded in place of the result, any other exception is propagated.
+    """
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers)
+    pending = {}
+
+    def submit(count):
+        for item in islice(items, count):
+            pending[executor.submit(func, item)] = item
+
+    try:
+        submit(max_workers)
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    result = future.result()
+                except catch as e:
+                    result = e
+                yield item, result
+            submit(max_workers - len(pending))
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def map_ordered(func, items, max_workers, catch=()):
+    """Same as :func:`iter_completed`, but returns the list of results in
+    the order of `items`.
+    """
+    def call(indexed_item):
+        return func(indexed_item[1])
+
+    results = {}
+    for (index, _), result in iter_completed(call, enumerate(items),
+                                             max_workers, catch):
+        results[index] = result
+    return [results[index] for index in xrange(len(results))]
+
+
+def iter_ordered(func, items, max_workers):
+    """Calls `func` for every item of `items` using `max_workers` threads.
+    Yields the results in the order of `items`; exceptions are propagated.
+
+    Only `max_workers` items ahead of the consumer are taken from `items`,
+    so no more than ``max_workers + 1`` results are kept in memory at once.
+    """
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers)
+    pending = deque()
+    try:
+        for item in islice(items, max_workers):
+            pending.append(executor.submit(func, item))
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(executor.submit(func, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,114 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+
+class UploadIndex(object):
+    """Persistent index of the uploaded content: maps content hash and type
+    identifier to the resource URI. With the index
+    :meth:`UnistorageClient.upload_file` doesn't upload the same content twice.
+
+    The index is kept in an SQLite database and can be shared by processes.
+
+    :param path: Path of the database file.
+    :param algorithm: Name of the :mod:`hashlib` hash algorithm.
+    :param max_entries: Maximum number of entries; the least recently used
+        entries are evicted.
+    :param chunk_size: Number of bytes read at once while hashing.
+
+    .. code-block:: python
+
+        >>> index = UploadIndex('/var/cache/unistorage/uploads.db', algorithm='sha256')
+        >>> unistorage = UnistorageClient(url, token, upload_index=index)
+    """
+    def __init__(self, path, algorithm='sha1', max_entries=100000,
+                 chunk_size=65536):
+        hashlib.new(algorithm)
+        self.path = path
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                'key TEXT PRIMARY KEY, resource_uri TEXT NOT NULL, used_at REAL NOT NULL)')
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def key(self, file_content, type_id=None):
+        """Returns the index key of `file_content` or ``None`` if the content
+        can't be read twice (it's neither a string nor a seekable file).
+        The position of the file is restored.
+        """
+        content_hash = hashlib.new(self.algorithm)
+        if isinstance(file_content, str):
+            content_hash.update(file_content)
+        elif hasattr(file_content, 'seek') and hasattr(file_content, 'tell'):
+            try:
+                position = file_content.tell()
+                file_content.seek(position)
+            except (IOError, OSError):
+                # Not seekable, e.g. a pipe
+                return None
+            for chunk in iter(lambda: file_content.read(self.chunk_size), ''):
+                content_hash.update(chunk)
+            file_content.seek(position)
+        else:
+            return None
+        return '%s:%s:%s' % (self.algorithm, content_hash.hexdigest(), type_id or '')
+
+    def get(self, key):
+        """Returns the resource URI stored under `key` or ``None``."""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT resource_uri FROM uploads WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                'UPDATE uploads SET used_at = ? WHERE key = ?', (time.time(), key))
+            return row[0]
+
+    def add(self, key, resource_uri):
+        """Stores `resource_uri` under `key`."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)',
+                (key, resource_uri, time.time()))
+            self._connection.execute(
+                'DELETE FROM uploads WHERE key IN (SELECT key FROM uploads '
+                'ORDER BY used_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def remove(self, key):
+        """Removes `key` from the index."""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM uploads WHERE key = ?', (key,))
+
+    def verify(self, unistorage, max_workers=None):
+        """Checks that the stored URIs still resolve and removes the entries whose
+        files no longer exist. Returns the number of removed entries.
+
+        :param unistorage: Unistorage client.
+        """
+        keys = defaultdict(list)
+        with self._lock:
+            for key, resource_uri in self._connection.execute(
+                    'SELECT key, resource_uri FROM uploads'):
+                keys[resource_uri].append(key)
+        removed = 0
+        for resource_uri, result in unistorage.iter_files(list(keys),
+                                                          max_workers=max_workers):
+            if getattr(result, 'status_code', None) == 404:
+                for key in keys[resource_uri]:
+                    self.remove(key)
+                    removed += 1
+        return removed
@@ -0,0 +1,178 @@
+import bisect
+import threading
+
+import decorator
+
+
+_local = threading.local()
+
+
+def current_operation():
+    """Returns the name of the client operation running in this thread."""
+    return getattr(_local, 'operation', None)
+
+
+def operation(name):
+    """Decorator that names requests sent by the decorated client method
+    (for the hooks and the limiter). The outermost operation wins, e.g.
+    the metadata request of :meth:`apply_action` is reported as ``'apply_action'``.
+    """
+    @decorator.decorator
+    def call(method, self, *args, **kwargs):
+        if not (self.hooks or self.limiter) or current_operation() is not None:
+            return method(self, *args, **kwargs)
+        _local.operation = name
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _local.operation = None
+    return call
+
+
+class RequestEvent(object):
+    """Describes a request sent by the client (including its retries) or
+    a request answered from the cache.
+
+    .. attribute:: operation
+
+        Name of the client method, e.g. ``'upload_file'``.
+
+    .. attribute:: method
+
+        HTTP method.
+
+    .. attribute:: url
+
+        Relative URL.
+
+    .. attribute:: status_code
+
+        Status of the last response or ``None``.
+
+    .. attribute:: latency
+
+        Seconds spent, including retries.
+
+    .. attribute:: bytes_sent
+
+        Size of the request body.
+
+    .. attribute:: bytes_received
+
+        Size of the response body.
+
+    .. attribute:: retries
+
+        Number of retries.
+
+    .. attribute:: cache
+
+        ``'hit'``, ``'miss'`` or ``None`` if the cache wasn't consulted.
+
+    .. attribute:: error
+
+        Name of the exception class if the request failed.
+    """
+    __slots__ = ('operation', 'method', 'url', 'status_code', 'latency',
+                 'bytes_sent', 'bytes_received', 'retries', 'cache', 'error')
+
+    def __init__(self, operation, method, url, cache=None):
+        self.operation = operation
+        self.method = method
+        self.url = url
+        self.cache = cache
+        self.status_code = None
+        self.latency = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.error = None
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+
+    def add(self, event):
+        self.counts[bisect.bisect_left(self.buckets, event.latency)] += 1
+        self.count += 1
+        self.sum += event.latency
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received
+        self.retries += event.retries
+
+    def percentile(self, q):
+        """Returns the upper bound of the bucket containing the `q` quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return 0.0
+
+
+class HistogramCollector(object):
+    """Hook that collects latency histograms and byte counters of the requests,
+    grouped by operation, HTTP method, status (or error) and cache outcome.
+
+    :param buckets: Upper bounds of the latency buckets in seconds.
+
+    .. code-block:: python
+
+        >>> collector = HistogramCollector()
+        >>> unistorage = UnistorageClient(url, token, hooks=[collector])
+        >>> collector.snapshot()[0]['p99']
+        0.1
+    """
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        key = (event.operation, event.method, event.error or event.status_code, event.cache)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.add(event)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Returns list of dictionaries (one per group) that can be exported to
+        a metrics system. Bucket counts are cumulative, as in Prometheus.
+        """
+        result = []
+        with self._lock:
+            for (operation, method, status, cache), histogram in self._histograms.items():
+                cumulative, buckets = 0, []
+                for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                result.append({
+                    'operation': operation,
+                    'method': method,
+                    'status': status,
+                    'cache': cache,
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': buckets,
+                    'p50': histogram.percentile(0.5),
+                    'p99': histogram.percentile(0.99),
+                    'bytes_sent': histogram.bytes_sent,
+                    'bytes_received': histogram.bytes_received,
+                    'retries': histogram.retries,
+                })
+        return result
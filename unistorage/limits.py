@@ -0,0 +1,196 @@
+import threading
+import time
+
+
+#: Classes of the client operations, used to pick the rate limit. Operations
+#: that aren't listed (:meth:`get_file`, :meth:`get_zip_file`) are ``'metadata'``.
+OPERATION_CLASSES = {
+    'upload_file': 'upload',
+    'apply_action': 'action',
+    'apply_actions': 'action',
+    'apply_template': 'action',
+    'create_template': 'action',
+    'get_zipped': 'action',
+}
+
+
+def operation_class(operation, method=None, params=None):
+    """Returns ``'upload'``, ``'action'`` or ``'metadata'`` for the request
+    sent by the client operation `operation` (see
+    :func:`unistorage.instrumentation.current_operation`). A ``GET`` request
+    without parameters only retrieves a file, e.g. the one that follows the
+    upload in :meth:`UnistorageClient.upload_file`, so it is ``'metadata'``
+    whatever the operation.
+    """
+    if method is not None and method.upper() == 'GET' and not params:
+        return 'metadata'
+    return OPERATION_CLASSES.get(operation, 'metadata')
+
+
+class TokenBucket(object):
+    """Limits the rate of requests to `rate` per second on average, allowing
+    bursts of up to `burst` requests. Callers that exceed the rate wait in
+    the order of arrival.
+
+    :param rate: Number of requests per second.
+    :param burst: Maximum number of requests sent at once; defaults to `rate`.
+    """
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.clock = clock
+        self.sleep = sleep
+        self.requests = 0
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Takes `tokens` from the bucket, waiting until they are available.
+        Returns the number of seconds waited.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self._tokens + (now - self._updated_at) * self.rate,
+                               self.burst)
+            self._updated_at = now
+            # Tokens are reserved before waiting, so later callers wait longer
+            self._tokens -= tokens
+            delay = max(-self._tokens / self.rate, 0.0)
+            self.requests += 1
+            self.waited += delay
+        if delay:
+            self.sleep(delay)
+        return delay
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'requests': self.requests,
+                'queue_delay': self.requests and self.waited / self.requests or 0.0,
+            }
+
+
+class AdaptiveConcurrencyLimit(object):
+    """Limits the number of requests in flight and adjusts the limit with
+    the AIMD algorithm: every successful request increases the limit by
+    ``increase / limit`` (that is, by `increase` per round of requests), and a
+    failed one (timeout or ``5xx`` response) multiplies it by `decrease`.
+    Failures of the requests that started before the last decrease don't
+    decrease the limit again.
+
+    :param initial: Initial limit.
+    :param min_limit: Minimum limit.
+    :param max_limit: Maximum limit.
+    :param increase: Additive increase per round of successful requests.
+    :param decrease: Multiplicative decrease after a failure.
+    """
+    def __init__(self, initial=8, min_limit=1, max_limit=64, increase=1.0,
+                 decrease=0.5, clock=time.time):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.clock = clock
+        self.in_flight = 0
+        self.queued = 0
+        self.requests = 0
+        self.waited = 0.0
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Waits until a request can be sent. Returns ``(ticket, delay)``;
+        the ticket must be passed to :meth:`release`.
+        """
+        with self._condition:
+            started_at = self.clock()
+            self.queued += 1
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.queued -= 1
+            self.in_flight += 1
+            delay = self.clock() - started_at
+            self.requests += 1
+            self.waited += delay
+            return self._generation, delay
+
+    def release(self, ticket, success):
+        """Reports the outcome of the request started with `ticket`."""
+        with self._condition:
+            self.in_flight -= 1
+            if success:
+                self.limit = min(self.limit + self.increase / self.limit, self.max_limit)
+            elif ticket == self._generation:
+                self.limit = max(self.limit * self.decrease, self.min_limit)
+                self._generation += 1
+            self._condition.notify_all()
+
+    @property
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'requests': self.requests,
+                'queue_delay': self.requests and self.waited / self.requests or 0.0,
+            }
+
+
+class RequestLimiter(object):
+    """Rate and concurrency limits of the requests sent by a client.
+
+    :param rates: Dictionary that maps operation classes (``'upload'``,
+        ``'action'``, ``'metadata'``, see :func:`operation_class`) to
+        :class:`TokenBucket` or to the number of requests per second.
+    :param concurrency: Optional :class:`AdaptiveConcurrencyLimit` shared
+        by all the requests.
+
+    .. code-block:: python
+
+        >>> limiter = RequestLimiter(
+        ...     rates={'upload': 5, 'action': 50, 'metadata': 200},
+        ...     concurrency=AdaptiveConcurrencyLimit(initial=16, max_limit=64))
+        >>> unistorage = UnistorageClient(url, token, limiter=limiter)
+        >>> limiter.stats['concurrency']['limit']
+        23
+    """
+    def __init__(self, rates=None, concurrency=None):
+        self.buckets = {}
+        for name, rate in (rates or {}).items():
+            self.buckets[name] = rate if isinstance(rate, TokenBucket) else TokenBucket(rate)
+        self.concurrency = concurrency
+
+    def acquire(self, operation, method=None, params=None):
+        """Waits until a request of `operation` can be sent. Returns the ticket
+        to be passed to :meth:`release`. `method` and `params` of the request
+        are used to classify it, see :func:`operation_class`.
+        """
+        bucket = self.buckets.get(operation_class(operation, method, params))
+        if bucket is not None:
+            bucket.acquire()
+        if self.concurrency is not None:
+            return self.concurrency.acquire()[0]
+
+    def release(self, ticket, success):
+        """Reports whether the request succeeded, i.e. didn't time out and
+        received a response with status below ``500``.
+        """
+        if self.concurrency is not None:
+            self.concurrency.release(ticket, success)
+
+    @property
+    def stats(self):
+        """Dictionary with the current limits, the numbers of requests and
+        the average queueing delays in seconds.
+        """
+        return {
+            'rates': dict((name, bucket.stats) for name, bucket in self.buckets.items()),
+            'concurrency': self.concurrency and self.concurrency.stats,
+        }
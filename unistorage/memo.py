@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+import time
+import urllib
+
+
+class DerivedFileMemo(object):
+    """Persistent memo of the derived files: maps source file URI and action
+    (or template) to the URI of the resulting file. With the memo
+    :meth:`UnistorageClient.apply_action` and :meth:`UnistorageClient.apply_template`
+    don't ask the server again for the files that were already derived.
+
+    The memo is kept in an SQLite database in WAL mode, so it can be shared by
+    the processes of one host: readers don't block the writer, and concurrent
+    writers wait for each other for up to `timeout` seconds.
+
+    Only final results are stored: if the derived file is still being
+    processed (it is :class:`unistorage.models.PendingFile`) or isn't
+    retrieved (``lazy=True``), the mapping isn't memoized.
+
+    :param path: Path of the database file.
+    :param max_entries: Maximum number of entries; the oldest entries are evicted.
+    :param timeout: Seconds to wait for the database lock.
+
+    .. code-block:: python
+
+        >>> memo = DerivedFileMemo('/var/cache/unistorage/derived.db')
+        >>> unistorage = UnistorageClient(url, token, derived_memo=memo)
+    """
+    def __init__(self, path, max_entries=100000, timeout=30):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS derived ('
+                'key TEXT PRIMARY KEY, resource_uri TEXT NOT NULL, created_at REAL NOT NULL)')
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM derived').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def key(file_uri, action=None, template=None):
+        """Returns the memo key of `action` or `template` applied to the file
+        with `file_uri`. The action arguments are sorted and its priority is
+        ignored, as they don't change the result.
+        """
+        if template is not None:
+            return '%s template:%s' % (file_uri, template.resource_uri)
+        return '%s action:%s' % (file_uri, urllib.urlencode(sorted(action.to_dict().items())))
+
+    def get(self, key):
+        """Returns the resource URI stored under `key` or ``None``."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT resource_uri FROM derived WHERE key = ?', (key,)).fetchone()
+        return row and row[0]
+
+    def add(self, key, resource_uri):
+        """Stores `resource_uri` under `key`."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO derived VALUES (?, ?, ?)',
+                (key, resource_uri, time.time()))
+            # Replaced rows get new rowids, so rowids grow in insertion order
+            self._connection.execute(
+                'DELETE FROM derived WHERE rowid <= (SELECT MAX(rowid) FROM derived) - ?',
+                (self.max_entries,))
+
+    def remove(self, key):
+        """Removes `key` from the memo."""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM derived WHERE key = ?', (key,))
@@ -1,9 +1,11 @@
+import functools
 import sys
 import urllib
 import warnings
 
 import decorator
 
+from compact import CompactError, Decoder, Encoder
 from filetypes import is_image, is_video, is_document
 
 
@@ -29,11 +31,13 @@ class Action(dict):
         self.with_low_priority = kwargs.get('with_low_priority', False)
 
     def encode(self):
-        """Returns URL-encoded representation of this action."""
+        """Returns URL-encoded representation of this action.
+        Arguments are sorted, so equal actions have equal representations.
+        """
         data = self.to_dict()
         if self.with_low_priority:
             data['with_low_priority'] = 1
-        return urllib.urlencode(data)
+        return urllib.urlencode(sorted(data.items()))
 
     def to_dict(self):
         """Returns dictionary that contains both action arguments and action name.
@@ -46,13 +50,20 @@ class Template(object):
     """Represents template.
 
     :param resource_uri: File resource URI.
+    :param applicable_for: Files type for that template can be applied
+        (``'image'``, ``'video'`` or ``'doc'``) if it is known.
 
     .. attribute:: resource_uri
 
         Resource URI.
+
+    .. attribute:: applicable_for
+
+        Files type for that template can be applied or ``None``.
     """
-    def __init__(self, resource_uri):
+    def __init__(self, resource_uri, applicable_for=None):
         self.resource_uri = resource_uri
+        self.applicable_for = applicable_for
 
 
 class File(object):
@@ -69,16 +80,62 @@ class File(object):
 
         TTL.
     """
+    __slots__ = ('resource_uri', '_ttl')
+
     def __init__(self, resource_uri, response):
         self.resource_uri = resource_uri
-        self.ttl = response.get('ttl')
+        self._ttl = response.get('ttl')
 
     def __str__(self):
         return self.resource_uri
 
+    def _get_ttl(self):
+        return self._ttl
+
+    def _set_ttl(self, ttl):
+        self._ttl = ttl
+
+    ttl = property(_get_ttl, _set_ttl)
+
+    @classmethod
+    def _slot_names(cls):
+        return [name for klass in reversed(cls.__mro__)
+                for name in klass.__dict__.get('__slots__', ())]
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self._slot_names()
+                    if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def to_compact(self):
+        """Returns compact binary representation of this file to be stored
+        in an external cache. See :meth:`FileFactory.to_compact`.
+        """
+        return FileFactory.to_compact(self)
+
+    @classmethod
+    def from_compact(cls, data):
+        """Restores file from the :meth:`to_compact` representation.
+
+        .. code-block:: python
+
+            >>> memcache.set(image_file.resource_uri, image_file.to_compact())
+            >>> ImageFile.from_compact(memcache.get(image_file.resource_uri))
+            <models.ImageFile object at 0x13edf10>
+        """
+        file = FileFactory.from_compact(data)
+        if not isinstance(file, cls):
+            raise CompactError('%s is not %s.' % (type(file).__name__, cls.__name__))
+        return file
+
 
 class PendingFile(File):
     """Represents pending file (pending files have status ``'wait'``)."""
+    __slots__ = ()
+
     def __init__(self, resource_uri, response):
         super(PendingFile, self).__init__(resource_uri, response)
 
@@ -90,6 +147,8 @@ class TemporaryFile(File):
 
         URL of the binary content.
     """
+    __slots__ = ('url',)
+
     def __init__(self, resource_uri, response):
         super(TemporaryFile, self).__init__(resource_uri, response)
         data = response['data']
@@ -103,6 +162,8 @@ class ZipFile(File):
 
         URL of the binary content.
     """
+    __slots__ = ('url',)
+
     def __init__(self, resource_uri, response):
         super(ZipFile, self).__init__(resource_uri, response)
         data = response['data']
@@ -127,7 +188,14 @@ class RegularFile(File):
     .. attribute:: name
 
         Name.
+
+    .. attribute:: applicable_for
+
+        Type of the templates that can be applied to this file or ``None``.
     """
+    __slots__ = ('url', 'mimetype', 'size', 'name')
+    applicable_for = None
+
     def __init__(self, resource_uri, response):
         super(RegularFile, self).__init__(resource_uri, response)
         data = response['data']
@@ -148,26 +216,89 @@ class RegularFile(File):
         """
         return unistorage.apply_template(self, template,
                                          with_low_priority=with_low_priority)
-    
-    def __getattribute__(self, name):
-        rv = super(RegularFile, self).__getattribute__(name)
-        if name == 'ttl':
-            warnings.warn('RegularFile.ttl is deprecated and will contain None '
-                          'in future API versions.', FutureWarning, stacklevel=2)
-            if rv is None:
-                rv = sys.maxint
-        return rv
+
+    def pipeline(self):
+        """Returns :class:`Pipeline` of actions to be applied to this file.
+
+        :rtype: :class:`unistorage.models.Pipeline`
+        """
+        return Pipeline(self)
+
+    def _get_ttl(self):
+        warnings.warn('RegularFile.ttl is deprecated and will contain None '
+                      'in future API versions.', FutureWarning, stacklevel=2)
+        if self._ttl is None:
+            return sys.maxint
+        return self._ttl
+
+    ttl = property(_get_ttl, File._set_ttl)
 
 
 @decorator.decorator
-def action(method, self, unistorage, *args, **kwargs):
+def _apply_action(method, self, unistorage, *args, **kwargs):
     with_low_priority = kwargs.pop('with_low_priority', False)
+    lazy = kwargs.pop('lazy', False)
     action_name, action_args = method(self, unistorage, *args, **kwargs)
     action = Action(action_name, action_args, with_low_priority=with_low_priority)
-    return unistorage.apply_action(self, action)
+    return unistorage.apply_action(self, action, lazy=lazy)
+
+
+def action(method):
+    """Turns `method` that returns action name and arguments into the method
+    that applies the action to the file.
+    """
+    method = _apply_action(method)
+    method.is_action = True
+    return method
+
+
+class Pipeline(object):
+    """Chain of actions to be applied to the file. Actions are recorded
+    without sending any requests; :meth:`apply` applies the whole chain
+    as a single template.
+
+    :param file: Source file.
+    :type file: :class:`RegularFile`
+
+    Pipeline has the same action methods as its file, but they take no
+    Unistorage client and return a new pipeline:
+
+    .. code-block:: python
+
+        >>> pipeline = image_file.pipeline().resize('keep', 50, 50).grayscale()
+        >>> pipeline.apply(unistorage)
+        <models.PendingFile object at 0x2a1bf50>
+    """
+    def __init__(self, file, actions=()):
+        self.file = file
+        self.actions = list(actions)
+
+    def __getattr__(self, name):
+        method = getattr(self.file, name)
+        if not getattr(method, 'is_action', False):
+            raise AttributeError(name)
+        return functools.partial(method, self)
+
+    def apply_action(self, file, action, lazy=False):
+        return Pipeline(self.file, self.actions + [action])
+
+    def apply(self, unistorage, with_low_priority=False, lazy=False):
+        """Applies recorded actions to the file.
+
+        :param unistorage: Unistorage client
+        :type unistorage: :class:`unistorage.client.UnistorageClient`
+        :type with_low_priority: :class:`bool`
+        :param lazy: Whether to return :class:`LazyFile`.
+        :rtype: :class:`unistorage.models.File`
+        """
+        return unistorage.apply_actions(self.file, self.actions,
+                                        with_low_priority=with_low_priority,
+                                        lazy=lazy)
 
 
 class Watermarkable(object):
+    __slots__ = ()
+
     @action
     def watermark(self, unistorage, watermark, corner, w, h, w_pad, h_pad, **kwargs):
         """:rtype: :class:`File`"""
@@ -196,6 +327,9 @@ class ImageFile(RegularFile, Watermarkable):
 
         EXIF orientation (number from 1 to 8).
     """
+    __slots__ = ('width', 'height', 'orientation')
+    applicable_for = 'image'
+
     def __init__(self, resource_uri, response):
         super(ImageFile, self).__init__(resource_uri, response)
         extra = response['data']['extra']
@@ -239,6 +373,9 @@ class VideoFile(RegularFile, Watermarkable):
 
         Video codec.
     """
+    __slots__ = ('width', 'height', 'codec')
+    applicable_for = 'video'
+
     def __init__(self, resource_uri, response):
         super(VideoFile, self).__init__(resource_uri, response)
         extra = response['data']['extra']
@@ -269,6 +406,9 @@ class VideoFile(RegularFile, Watermarkable):
 
 class DocFile(RegularFile):
     """Represents document file."""
+    __slots__ = ()
+    applicable_for = 'doc'
+
     @action
     def convert(self, unistorage, to, **kwargs):
         """:rtype: :class:`File`"""
@@ -277,12 +417,53 @@ class DocFile(RegularFile):
 
 class AudioFile(RegularFile):
     """Represents audio file."""
+    __slots__ = ()
+
     @action
     def convert(self, unistorage, to, **kwargs):
         """:rtype: :class:`File`"""
         return 'convert', {'to': to}
 
 
+class LazyFile(object):
+    """Proxy of the file that is retrieved from the Unistorage only when one
+    of its attributes other than :attr:`resource_uri` is accessed.
+
+    :param unistorage: Unistorage client
+    :type unistorage: :class:`unistorage.client.UnistorageClient`
+    :param resource_uri: File resource URI.
+
+    .. code-block:: python
+
+        >>> thumbnail = image_file.resize(unistorage, 'crop', 50, 50, lazy=True)
+        >>> thumbnail.resource_uri  # no request is sent
+        '/523d6e5a8149950ad2fba5e2/'
+        >>> thumbnail.url
+        'http://localhost/523d6e5a8149950ad2fba5e2'
+    """
+    __slots__ = ('resource_uri', '_unistorage', '_file')
+
+    def __init__(self, unistorage, resource_uri):
+        self.resource_uri = resource_uri
+        self._unistorage = unistorage
+        self._file = None
+
+    @property
+    def file(self):
+        """Retrieved :class:`File`."""
+        if self._file is None:
+            self._file = self._unistorage.get_file(self.resource_uri)
+        return self._file
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.file, name)
+
+    def __str__(self):
+        return self.resource_uri
+
+
 class FileFactory(object):
     unistorage_type_map = {
         'unknown': RegularFile,
@@ -308,3 +489,64 @@ class FileFactory(object):
             file_class = PendingFile
 
         return file_class(resource_uri, file_data)
+
+    #: File classes in the order of their codes in the compact representation.
+    #: New classes must be appended.
+    compact_classes = (PendingFile, TemporaryFile, ZipFile, RegularFile,
+                       ImageFile, VideoFile, AudioFile, DocFile)
+
+    _compact_codes = dict((file_class, code) for code, file_class in enumerate(compact_classes))
+    _compact_fields = [file_class._slot_names() for file_class in compact_classes]
+
+    @classmethod
+    def to_compact(cls, file):
+        """Returns compact binary representation of `file`: the values of its
+        attributes in a versioned binary format that is about half the size of
+        the pickle. Use :meth:`from_compact` to restore the file.
+        """
+        return cls.to_compact_list([file])
+
+    @classmethod
+    def from_compact(cls, data):
+        """Restores file from the :meth:`to_compact` representation.
+        Raises :class:`unistorage.compact.CompactError` if `data` is malformed.
+        """
+        files = cls.from_compact_list(data)
+        if len(files) != 1:
+            raise CompactError('Expected one file, got %d.' % len(files))
+        return files[0]
+
+    @classmethod
+    def to_compact_list(cls, files):
+        """Returns compact binary representation of the list of `files`.
+        Strings repeated in the files (e.g. MIME types) are stored once.
+        """
+        files = list(files)
+        encoder = Encoder()
+        encoder.write_uint(len(files))
+        for file in files:
+            code = cls._compact_codes.get(type(file))
+            if code is None:
+                raise TypeError('%s can\'t be encoded.' % type(file).__name__)
+            encoder.write_uint(code)
+            for name in cls._compact_fields[code]:
+                encoder.write(getattr(file, name, None))
+        return encoder.getvalue()
+
+    @classmethod
+    def from_compact_list(cls, data):
+        """Restores the list of files from the :meth:`to_compact_list` representation."""
+        decoder = Decoder(data)
+        files = []
+        for _ in xrange(decoder.read_uint()):
+            code = decoder.read_uint()
+            if code >= len(cls.compact_classes):
+                raise CompactError('Unknown file class %d.' % code)
+            file_class = cls.compact_classes[code]
+            file = file_class.__new__(file_class)
+            for name in cls._compact_fields[code]:
+                setattr(file, name, decoder.read())
+            files.append(file)
+        if not decoder.at_end():
+            raise CompactError('Unexpected data after the files.')
+        return files
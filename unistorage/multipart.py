@@ -0,0 +1,155 @@
+import os
+
+from requests.packages.urllib3.fields import RequestField
+from requests.packages.urllib3.filepost import choose_boundary
+
+
+def _part_header(boundary, name, filename=None):
+    field = RequestField(name=name, data='', filename=filename)
+    field.make_multipart()
+    return '--%s\r\n%s' % (boundary, field.render_headers().encode('utf-8'))
+
+
+def _content_length(content):
+    """Returns the number of bytes left in `content` or ``None`` if it's unknown."""
+    if isinstance(content, str):
+        return len(content)
+    if not hasattr(content, 'read'):
+        return None
+    if hasattr(content, 'fileno'):
+        try:
+            return os.fstat(content.fileno()).st_size - content.tell()
+        except (AttributeError, IOError, OSError):
+            pass
+    if hasattr(content, 'seek') and hasattr(content, 'tell'):
+        try:
+            position = content.tell()
+            content.seek(0, os.SEEK_END)
+            length = content.tell() - position
+            content.seek(position)
+        except (IOError, OSError):
+            # Not seekable, e.g. a pipe
+            return None
+        return length
+    return None
+
+
+class MultipartEncoder(object):
+    """``multipart/form-data`` request body that is produced in chunks, so the
+    uploaded content is never held in memory as a whole.
+
+    The body is both a file-like object and an iterable, as the `requests
+    <http://docs.python-requests.org/>`_ library expects of streamed bodies.
+    If the size of `file_content` can't be determined (e.g. it is
+    a generator), :attr:`len` is ``None`` and the body has to be sent with
+    the chunked transfer encoding.
+
+    :param fields: List of ``(name, value)`` form fields.
+    :param file_name: Name of the uploaded file.
+    :param file_content: String, file-like object or iterable of strings.
+    :param chunk_size: Maximum number of bytes read from `file_content` at once.
+    :param callback: Function that is called with the number of bytes sent
+        and the total size of the body (or ``None``) after every chunk.
+
+    .. attribute:: content_type
+
+        Value of the ``Content-Type`` header.
+
+    .. attribute:: len
+
+        Size of the body in bytes or ``None``.
+    """
+    def __init__(self, fields, file_name, file_content, chunk_size=65536,
+                 callback=None):
+        boundary = choose_boundary()
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.file_content = file_content
+
+        head = []
+        for name, value in fields:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            head.append('%s%s\r\n' % (_part_header(boundary, name), value))
+        head.append(_part_header(boundary, 'file', file_name))
+        self._head = ''.join(head)
+        self._tail = '\r\n--%s--\r\n' % boundary
+
+        self._start = None
+        if hasattr(file_content, 'seek') and hasattr(file_content, 'tell'):
+            try:
+                self._start = file_content.tell()
+            except (IOError, OSError):
+                pass
+
+        content_length = _content_length(file_content)
+        if content_length is None:
+            self.len = None
+        else:
+            self.len = len(self._head) + content_length + len(self._tail)
+
+        self._reset()
+
+    def _reset(self):
+        self.bytes_read = 0
+        self._buffer = ''
+        self._offset = 0
+        self._chunks = self._generate()
+
+    def rewind(self):
+        """Restarts the body from the beginning, so it can be sent again.
+        Returns ``False`` if `file_content` can't be read again.
+        """
+        if self._start is not None:
+            self.file_content.seek(self._start)
+        elif self.bytes_read and not isinstance(self.file_content, str):
+            return False
+        self._reset()
+        return True
+
+    def _generate(self):
+        yield self._head
+        content = self.file_content
+        if isinstance(content, str):
+            for offset in xrange(0, len(content), self.chunk_size):
+                yield content[offset:offset + self.chunk_size]
+        elif hasattr(content, 'read'):
+            while True:
+                chunk = content.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        else:
+            for chunk in content:
+                yield chunk
+        yield self._tail
+
+    def _consumed(self, chunk):
+        self.bytes_read += len(chunk)
+        if self.callback is not None:
+            self.callback(self.bytes_read, self.len)
+        return chunk
+
+    def read(self, size=-1):
+        """Reads at most `size` bytes of the body."""
+        if size is None or size < 0:
+            rest = self._buffer[self._offset:] + ''.join(self._chunks)
+            self._buffer, self._offset = '', 0
+            return self._consumed(rest)
+        while self._offset >= len(self._buffer):
+            self._buffer, self._offset = next(self._chunks, None), 0
+            if self._buffer is None:
+                self._buffer = ''
+                return ''
+        chunk = self._buffer[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        return self._consumed(chunk)
+
+    def __iter__(self):
+        if self._offset < len(self._buffer):
+            yield self._consumed(self._buffer[self._offset:])
+        self._buffer, self._offset = '', 0
+        for chunk in self._chunks:
+            if chunk:
+                yield self._consumed(chunk)
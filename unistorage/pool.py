@@ -0,0 +1,127 @@
+import threading
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import (HTTPConnection,
+                                                  HTTPSConnection)
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+from requests.packages.urllib3.poolmanager import PoolManager
+
+
+class ConnectionStats(object):
+    """Thread-safe counters of the connections used by a client.
+
+    .. attribute:: opened
+
+        Number of connections that were newly opened.
+
+    .. attribute:: requests
+
+        Number of requests that were sent.
+    """
+    def __init__(self):
+        self.opened = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record_opened(self):
+        with self._lock:
+            self.opened += 1
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def reused(self):
+        """Number of requests that were sent over an already open connection."""
+        return max(self.requests - self.opened, 0)
+
+    def to_dict(self):
+        return {
+            'opened': self.opened,
+            'requests': self.requests,
+            'reused': self.reused,
+        }
+
+
+class CountingHTTPConnection(HTTPConnection):
+    stats = None
+
+    def connect(self):
+        if self.stats is not None:
+            self.stats.record_opened()
+        return super(CountingHTTPConnection, self).connect()
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    stats = None
+
+    def connect(self):
+        if self.stats is not None:
+            self.stats.record_opened()
+        return super(CountingHTTPSConnection, self).connect()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+    stats = None
+
+    def _new_conn(self):
+        conn = super(CountingHTTPConnectionPool, self)._new_conn()
+        conn.stats = self.stats
+        return conn
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+    stats = None
+
+    def _new_conn(self):
+        conn = super(CountingHTTPSConnectionPool, self)._new_conn()
+        conn.stats = self.stats
+        return conn
+
+
+class CountingPoolManager(PoolManager):
+    """:class:`PoolManager` whose pools report opened connections to `stats`."""
+    def __init__(self, stats, *args, **kwargs):
+        super(CountingPoolManager, self).__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, *args, **kwargs):
+        pool = super(CountingPoolManager, self)._new_pool(
+            scheme, host, port, *args, **kwargs)
+        pool.stats = self.stats
+        return pool
+
+
+class PoolingHTTPAdapter(HTTPAdapter):
+    """:class:`requests.adapters.HTTPAdapter` that keeps :class:`ConnectionStats`.
+
+    :param pool_connections: Number of per-host connection pools to cache.
+    :param pool_maxsize: Maximum number of connections kept open per host.
+    :param pool_block: Whether to block when all `pool_maxsize` connections
+        to the host are busy instead of opening a throw-away connection.
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False):
+        self.stats = ConnectionStats()
+        super(PoolingHTTPAdapter, self).__init__(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = CountingPoolManager(
+            self.stats, num_pools=connections, maxsize=maxsize, block=block,
+            strict=True, **pool_kwargs)
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super(PoolingHTTPAdapter, self).send(request, **kwargs)
@@ -0,0 +1,172 @@
+import logging
+import threading
+from Queue import Full, Queue
+
+from models import LazyFile, PendingFile
+
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher(object):
+    """Background workers that apply templates to the freshly uploaded files,
+    so renditions (e.g. thumbnails) are ready before they are requested.
+
+    When the prefetcher is attached to the client, every file returned by
+    :meth:`UnistorageClient.upload_file` is queued, and the templates whose
+    :attr:`~unistorage.models.Template.applicable_for` matches the type of
+    the file (:class:`~unistorage.models.ImageFile`,
+    :class:`~unistorage.models.VideoFile` or :class:`~unistorage.models.DocFile`)
+    are applied with low priority. If the queue is full, the file is dropped.
+
+    The results are written to the derived file memo of the client (see
+    :class:`unistorage.memo.DerivedFileMemo`), so the later
+    :meth:`UnistorageClient.apply_template` calls don't send requests. Renditions
+    that are still being processed are memoized only if `waiter` is given.
+
+    :param unistorage: Unistorage client.
+    :type unistorage: :class:`unistorage.client.UnistorageClient`
+    :param templates: List of :class:`unistorage.models.Template` with
+        `applicable_for`.
+    :param max_queue_size: Maximum number of files waiting for the workers.
+    :param workers: Number of worker threads.
+    :param waiter: Optional :class:`unistorage.waiter.PendingFileWaiter` that
+        waits for the pending renditions.
+
+    .. code-block:: python
+
+        >>> thumbnail = unistorage.create_template('image', [
+        ...     Action('resize', {'mode': 'crop', 'w': 100, 'h': 100})])
+        >>> unistorage.prefetcher = Prefetcher(unistorage, [thumbnail])
+    """
+    def __init__(self, unistorage, templates, max_queue_size=1000, workers=2,
+                 waiter=None):
+        for template in templates:
+            if template.applicable_for is None:
+                raise ValueError('Template %s has no applicable_for.' % template.resource_uri)
+        self.unistorage = unistorage
+        self.templates = list(templates)
+        self.workers = workers
+        self.waiter = waiter
+        self.submitted = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.prefetched = 0
+        self.failed = 0
+        self._queue = Queue(max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def stats(self):
+        """Dictionary with the numbers of files ``'submitted'`` to the queue,
+        ``'dropped'`` because it was full, ``'skipped'`` because no template
+        matches them, and templates ``'prefetched'`` and ``'failed'``.
+        """
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'skipped': self.skipped,
+                'prefetched': self.prefetched,
+                'failed': self.failed,
+                'queued': self._queue.qsize(),
+            }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def templates_for(self, file):
+        """Returns the templates that can be applied to `file`."""
+        applicable_for = getattr(file, 'applicable_for', None)
+        return [template for template in self.templates
+                if template.applicable_for == applicable_for]
+
+    def submit(self, file):
+        """Queues `file` for prefetching. Returns ``False`` if it was dropped
+        or skipped. :class:`unistorage.models.LazyFile` is retrieved by a worker.
+        """
+        if isinstance(file, PendingFile) or \
+                not isinstance(file, LazyFile) and not self.templates_for(file):
+            self._count('skipped')
+            return False
+        with self._lock:
+            if self._closed:
+                return False
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        try:
+            self._queue.put_nowait(file)
+        except Full:
+            self._count('dropped')
+            return False
+        self._count('submitted')
+        return True
+
+    def join(self):
+        """Blocks until all the queued files are processed."""
+        self._queue.join()
+
+    def close(self):
+        """Processes the queued files and stops the workers."""
+        with self._lock:
+            self._closed = True
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            file = self._queue.get()
+            try:
+                if file is None:
+                    return
+                self._prefetch(file)
+            except Exception:
+                logger.exception('Failed to prefetch file %s.', file)
+                self._count('failed')
+            finally:
+                self._queue.task_done()
+
+    def _prefetch(self, file):
+        try:
+            if isinstance(file, LazyFile):
+                file = file.file
+        except Exception:
+            logger.warning('Failed to retrieve uploaded file %s.', file, exc_info=True)
+            self._count('failed')
+            return
+        templates = self.templates_for(file)
+        if isinstance(file, PendingFile) or not templates:
+            self._count('skipped')
+            return
+
+        for template in templates:
+            try:
+                result = self.unistorage.apply_template(file, template,
+                                                        with_low_priority=True)
+            except Exception:
+                logger.warning('Failed to prefetch template %s for file %s.',
+                               template.resource_uri, file, exc_info=True)
+                self._count('failed')
+                continue
+            self._count('prefetched')
+            if isinstance(result, PendingFile) and self.waiter is not None:
+                self.waiter.wait(result, callback=self._memoizer(file, template))
+
+    def _memoizer(self, file, template):
+        """Returns callback that memoizes the processed rendition."""
+        def memoize(future):
+            memo = self.unistorage.derived_memo
+            if memo is not None and not future.cancelled() and \
+                    future.exception() is None:
+                memo.add(memo.key(file.resource_uri, template=template),
+                         future.result().resource_uri)
+        return memoize
@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+from requests.exceptions import ConnectTimeout
+
+
+class RetryPolicy(object):
+    """Defines which failed requests are retried and how long to wait before
+    the next attempt.
+
+    Requests with idempotent methods (``GET`` -- e.g. :meth:`get_file` and
+    :meth:`apply_action`) are retried on timeouts, connection errors and the
+    statuses from `status_forcelist`. Other requests (``POST`` -- uploads and
+    template creation) are retried only when the server certainly didn't
+    process them: the connection wasn't established or the response status
+    is ``429`` or ``503``.
+
+    The delay before the retry number ``n`` is a random value between ``0`` and
+    ``backoff_factor * 2 ** n`` seconds (but no more than `max_backoff`).
+    If the response has ``Retry-After`` header, its value is used instead;
+    if it exceeds `max_backoff`, the request is not retried.
+
+    :param total: Maximum number of retries.
+    :param backoff_factor: Base of the exponential backoff in seconds.
+    :param max_backoff: Maximum delay in seconds.
+    :param status_forcelist: Statuses of the responses to be retried.
+    :param retry_post: Whether to retry non-idempotent requests the same way
+        as idempotent ones.
+    """
+    idempotent_methods = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    #: Statuses of the requests that the server refused to process.
+    rejected_statuses = frozenset([429, 503])
+
+    def __init__(self, total=3, backoff_factor=0.5, max_backoff=30,
+                 status_forcelist=(429, 500, 502, 503, 504), retry_post=False):
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_forcelist = frozenset(status_forcelist)
+        self.retry_post = retry_post
+
+    def is_retryable(self, method, status_code=None, error=None):
+        """Returns whether the request with `method` that resulted in the response
+        with `status_code` or in the `error` (timeout or connection error) can be retried.
+        """
+        idempotent = self.retry_post or method.upper() in self.idempotent_methods
+        if status_code is not None:
+            return status_code in self.status_forcelist and (
+                idempotent or status_code in self.rejected_statuses)
+        return idempotent or isinstance(error, ConnectTimeout)
+
+    def get_backoff(self, retry_number, retry_after=None):
+        """Returns the delay in seconds before the retry number `retry_number`
+        (starting with ``0``) or ``None`` if the request must not be retried.
+
+        :param retry_after: Value of the ``Retry-After`` response header.
+        """
+        if retry_after:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                if delay > self.max_backoff:
+                    return None
+                return delay
+        return random.uniform(0, min(self.backoff_factor * 2 ** retry_number,
+                                     self.max_backoff))
+
+
+def parse_retry_after(value):
+    """Returns the number of seconds from the ``Retry-After`` header value
+    (either seconds or HTTP date) or ``None`` if it's malformed.
+    """
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(mktime_tz(date) - time.time(), 0)
+
+
+class CircuitBreaker(object):
+    """Stops sending requests after `failure_threshold` consecutive failures
+    (timeouts, connection errors and ``5xx`` responses). After
+    `recovery_timeout` seconds a single probe request is let through:
+    if it succeeds, requests are sent again. If the outcome of the probe
+    isn't recorded within `recovery_timeout` seconds, another probe is let
+    through.
+
+    :param failure_threshold: Number of consecutive failures that opens the breaker.
+    :param recovery_timeout: Seconds to wait before the probe request.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        self.failures = 0
+        self.state = self.CLOSED
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns whether a request can be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self.clock()
+            if now - self._opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                # The next probe is let through if this one never reports back
+                self._opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = self.clock()
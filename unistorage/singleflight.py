@@ -0,0 +1,84 @@
+import sys
+import threading
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical calls: while a call with some key is in
+    flight, other calls with the same key wait for it and receive its result
+    or its exception instead of sending their own requests.
+
+    With a single flight group :class:`UnistorageClient` coalesces ``GET``
+    requests (:meth:`get_file`, :meth:`apply_action`, :meth:`apply_template`)
+    by URL and query parameters. Calls that start after the shared request
+    completes send a new one, so no stale data is returned.
+
+    .. code-block:: python
+
+        >>> unistorage = UnistorageClient(url, token, single_flight=SingleFlight())
+
+    .. attribute:: calls
+
+        Number of calls.
+
+    .. attribute:: collapsed
+
+        Number of calls that waited for an identical call in flight.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'collapsed': self.collapsed,
+                'in_flight': len(self._calls),
+            }
+
+    def do(self, key, func, *args, **kwargs):
+        """Returns ``func(*args, **kwargs)``, or the result of the call with
+        the same `key` that is already in flight.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+        if leader:
+            return self._run(key, call, func, args, kwargs)
+        return self._wait(call)
+
+    def _run(self, key, call, func, args, kwargs):
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _wait(self, call):
+        call.done.wait()
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
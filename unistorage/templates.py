@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from models import Action, Template
+
+
+class TemplateRegistry(object):
+    """Registry of the created templates. Templates are keyed by the hash of
+    their type and encoded actions, so :meth:`UnistorageClient.create_template`
+    doesn't create the same template twice.
+
+    :param path: Optional path of the JSON file the registry is kept in.
+        The file can be shared by several processes.
+
+    .. code-block:: python
+
+        >>> registry = TemplateRegistry('/var/cache/unistorage/templates.json')
+        >>> unistorage = UnistorageClient(url, token, template_registry=registry)
+        >>> templates = registry.preload(unistorage, 'templates.json')
+        >>> image_file.apply_template(unistorage, templates['thumbnail'])
+        <models.TemporaryFile object at 0x28aadd0>
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._templates = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            self._templates.update(self._load())
+
+    def __len__(self):
+        return len(self._templates)
+
+    @staticmethod
+    def key(applicable_for, actions):
+        """Returns canonical hash of the template."""
+        encoded = [applicable_for] + [action.encode() for action in actions]
+        return hashlib.sha1('\n'.join(encoded)).hexdigest()
+
+    def get(self, applicable_for, actions):
+        """Returns registered :class:`unistorage.models.Template` or ``None``."""
+        resource_uri = self._templates.get(self.key(applicable_for, actions))
+        return resource_uri and Template(resource_uri, applicable_for)
+
+    def add(self, applicable_for, actions, template):
+        """Registers `template` created for `applicable_for` files with `actions`."""
+        key = self.key(applicable_for, actions)
+        with self._lock:
+            self._templates[key] = template.resource_uri
+            if self.path is not None:
+                self._save()
+
+    def preload(self, unistorage, config):
+        """Creates (or finds in the registry) the templates declared in `config`.
+        Returns dictionary that maps template names to :class:`unistorage.models.Template`.
+
+        :param unistorage: Unistorage client.
+        :param config: Path of the JSON file or dictionary of the form::
+
+            {"thumbnail": {"applicable_for": "image",
+                           "actions": [{"action": "resize", "mode": "keep", "w": 50, "h": 50},
+                                       {"action": "grayscale"}]}}
+        """
+        if isinstance(config, basestring):
+            with open(config) as f:
+                config = json.load(f)
+        templates = {}
+        for name, declaration in config.items():
+            actions = []
+            for action_args in declaration['actions']:
+                action_args = dict(action_args)
+                actions.append(Action(
+                    action_args.pop('action'), action_args,
+                    with_low_priority=action_args.pop('with_low_priority', False)))
+            templates[name] = unistorage.create_template(
+                declaration['applicable_for'], actions)
+        return templates
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self):
+        # Merge with the templates registered by other processes meanwhile
+        templates = self._load()
+        templates.update(self._templates)
+        self._templates = templates
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.templates')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(templates, f)
+        os.rename(temp_path, self.path)
@@ -0,0 +1,224 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+
+from client import UnistorageConnectionError, UnistorageError, UnistorageTimeout
+from models import PendingFile
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry(object):
+    def __init__(self, interval, next_due):
+        self.interval = interval
+        self.next_due = next_due
+        self.futures = []
+
+
+class PendingFileWaiter(object):
+    """Waits until pending files are processed, using a single scheduler thread.
+
+    Each tracked file is polled after its TTL, then with exponentially growing
+    intervals. Files that are due at the same time are polled as one batch
+    using :meth:`UnistorageClient.get_files`; the same URI is polled once no
+    matter how many callers wait for it. Timeouts and connection failures of
+    the polls are retried at the next interval.
+
+    :param unistorage: Unistorage client.
+    :type unistorage: :class:`unistorage.client.UnistorageClient`
+    :param max_concurrent_polls: Maximum number of simultaneous requests.
+    :param timeout: Default time in seconds to wait for a file. When it is
+        exceeded, the future fails with :class:`UnistorageTimeout`.
+    :param min_interval: Minimum polling interval in seconds.
+    :param max_interval: Maximum polling interval in seconds.
+    :param backoff: Factor by which the polling interval grows after each poll.
+
+    .. code-block:: python
+
+        >>> waiter = PendingFileWaiter(unistorage, timeout=600)
+        >>> futures = [waiter.wait(doc.convert(unistorage, 'pdf')) for doc in docs]
+        >>> futures[0].result()
+        <models.RegularFile object at 0x2d1c5d0>
+    """
+    def __init__(self, unistorage, max_concurrent_polls=10, timeout=300,
+                 min_interval=1, max_interval=60, backoff=1.5, clock=time.time):
+        self.unistorage = unistorage
+        self.max_concurrent_polls = max_concurrent_polls
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self._entries = {}
+        self._schedule = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _clamp(self, interval):
+        return min(max(interval or 0, self.min_interval), self.max_interval)
+
+    def wait(self, file, timeout=None, callback=None):
+        """Returns :class:`concurrent.futures.Future` that resolves to the processed
+        :class:`unistorage.models.File`. If `file` isn't pending, the future is
+        already done.
+
+        :param file: File returned by an action or a template.
+        :type file: :class:`unistorage.models.File`
+        :param timeout: Time in seconds to wait for the file; defaults to
+            the `timeout` of the waiter.
+        :param callback: Function to be called with the future when it is done.
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        if not isinstance(file, PendingFile):
+            future.set_result(file)
+            return future
+
+        if timeout is None:
+            timeout = self.timeout
+        deadline = self.clock() + timeout
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('PendingFileWaiter is closed.')
+            entry = self._entries.get(file.resource_uri)
+            if entry is None:
+                interval = self._clamp(file.ttl)
+                entry = _Entry(interval, self.clock() + interval)
+                self._entries[file.resource_uri] = entry
+                self._push(file.resource_uri, entry.next_due, poll=True)
+            entry.futures.append((deadline, future))
+            if deadline < entry.next_due:
+                self._push(file.resource_uri, deadline, poll=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def wait_all(self, files, timeout=None):
+        """Waits for all the `files` at most `timeout` seconds in total. Returns the
+        list of processed files in the order of `files`; a file that failed or
+        wasn't processed in time is replaced by the corresponding exception.
+        """
+        futures = [self.wait(file, timeout=timeout) for file in files]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except (UnistorageError, UnistorageTimeout) as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        """Stops the scheduler thread and cancels the files that are still waited for."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        for entry in self._entries.values():
+            for _, future in entry.futures:
+                future.cancel()
+        self._entries.clear()
+
+    def _push(self, uri, due, poll):
+        """Schedules the poll of `uri` or, if `poll` is false, the check of
+        the deadlines of its futures at `due`.
+        """
+        heapq.heappush(self._schedule, (due, next(self._counter), uri, poll))
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._closed:
+                now = self.clock()
+                if self._schedule and self._schedule[0][0] <= now:
+                    break
+                delay = self._schedule and self._schedule[0][0] - now or None
+                self._condition.wait(delay)
+            else:
+                return None
+
+            batch = set()
+            while self._schedule and self._schedule[0][0] <= now:
+                due, _, uri, poll = heapq.heappop(self._schedule)
+                entry = self._entries.get(uri)
+                if entry is None:
+                    continue
+                if poll and due == entry.next_due:
+                    batch.add(uri)
+                elif not poll:
+                    self._expire(uri, entry, now)
+            return [uri for uri in batch if uri in self._entries]
+
+    def _run(self):
+        while True:
+            uris = self._next_batch()
+            if uris is None:
+                return
+            try:
+                results = self.unistorage.get_files(
+                    uris, max_workers=self.max_concurrent_polls)
+            except Exception:
+                logger.warning('Failed to poll pending files.', exc_info=True)
+                results = [UnistorageTimeout()] * len(uris)
+            with self._condition:
+                for uri, result in zip(uris, results):
+                    self._handle(uri, result)
+
+    def _expire(self, uri, entry, now):
+        """Fails the futures of `uri` whose deadline has passed. Returns
+        whether any future is still waited for.
+        """
+        alive = []
+        for deadline, future in entry.futures:
+            if future.cancelled():
+                continue
+            if deadline <= now:
+                future.set_exception(UnistorageTimeout())
+            else:
+                alive.append((deadline, future))
+        entry.futures = alive
+        if not alive:
+            del self._entries[uri]
+        return bool(alive)
+
+    def _handle(self, uri, result):
+        entry = self._entries.get(uri)
+        if entry is None:
+            return
+        if not isinstance(result, (PendingFile, UnistorageTimeout, UnistorageConnectionError)):
+            del self._entries[uri]
+            for _, future in entry.futures:
+                if future.cancelled():
+                    continue
+                if isinstance(result, UnistorageError):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            return
+
+        now = self.clock()
+        if not self._expire(uri, entry, now):
+            return
+        entry.interval = self._clamp(entry.interval * self.backoff)
+        entry.next_due = now + entry.interval
+        self._push(uri, entry.next_due, poll=True)
+        # Deadlines before the next poll must be enforced without it
+        for deadline, _ in entry.futures:
+            if deadline < entry.next_due:
+                self._push(uri, deadline, poll=False)
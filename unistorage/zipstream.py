@@ -0,0 +1,203 @@
+import os
+import struct
+import time
+import zlib
+from tempfile import SpooledTemporaryFile
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+from concurrency import iter_ordered
+
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+UTF8_FLAG = 0x800
+
+
+def _dos_datetime(timestamp):
+    """Returns ``(time, date)`` of `timestamp` in the MS-DOS format."""
+    t = time.localtime(timestamp)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def unique_names(names):
+    """Yields `names` with the duplicates renamed deterministically:
+    the second ``'a.jpg'`` becomes ``'a (1).jpg'``, the third ``'a (2).jpg'``
+    and so on.
+    """
+    used = set()
+    for name in names:
+        base, ext = os.path.splitext(name)
+        number = 0
+        while name in used:
+            number += 1
+            name = '%s (%d)%s' % (base, number, ext)
+        used.add(name)
+        yield name
+
+
+class _Member(object):
+    """Downloaded and compressed content of an archive member."""
+    def __init__(self, name, spool_size, compression):
+        self.name = name
+        self.content = SpooledTemporaryFile(spool_size)
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+        self._compressor = None
+        if compression == ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def write(self, chunk):
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.size += len(chunk)
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk)
+        self.content.write(chunk)
+        self.compressed_size += len(chunk)
+
+    def flush(self):
+        if self._compressor is not None:
+            chunk = self._compressor.flush()
+            self.content.write(chunk)
+            self.compressed_size += len(chunk)
+        self.content.seek(0)
+
+
+class ZipStream(object):
+    """ZIP archive of the Unistorage files that is assembled on the client
+    and produced as a stream of chunks, as an alternative to
+    :meth:`UnistorageClient.get_zipped`.
+
+    The members are downloaded concurrently through the pooled connections and
+    written in the order of `files`; each downloaded member is kept in memory
+    only up to `spool_size` bytes (the rest goes to a temporary file), so
+    memory usage doesn't depend on the size or the number of the files.
+    ZIP64 extensions are used when the archive has more than 65535 members
+    or exceeds 4 GB.
+
+    Members are named after :attr:`RegularFile.name <unistorage.models.RegularFile.name>`;
+    duplicate names get a number, e.g. ``'photo (1).jpg'``.
+
+    :param unistorage: Unistorage client.
+    :type unistorage: :class:`unistorage.client.UnistorageClient`
+    :param files: Iterable of :class:`unistorage.models.RegularFile`.
+    :param max_workers: Maximum number of simultaneous downloads.
+    :param compression: :data:`zipfile.ZIP_STORED` or :data:`zipfile.ZIP_DEFLATED`.
+    :param chunk_size: Number of bytes to read and write at once.
+    :param spool_size: Number of bytes of a member kept in memory.
+
+    .. code-block:: python
+
+        >>> with open('/tmp/album.zip', 'wb') as f:
+        ...     ZipStream(unistorage, album).write_to(f)
+        104857600
+        >>> # Django
+        >>> StreamingHttpResponse(ZipStream(unistorage, album), content_type='application/zip')
+    """
+    def __init__(self, unistorage, files, max_workers=4, compression=ZIP_STORED,
+                 chunk_size=65536, spool_size=1048576):
+        if compression not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ValueError('Unsupported compression method: %r' % compression)
+        self.unistorage = unistorage
+        self.files = files
+        self.max_workers = max_workers
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.spool_size = spool_size
+        self.date_time = _dos_datetime(time.time())
+
+    def write_to(self, dest):
+        """Writes the archive to the writable file-like object `dest`.
+        Returns the size of the archive.
+        """
+        size = 0
+        for chunk in self:
+            dest.write(chunk)
+            size += len(chunk)
+        return size
+
+    def _download(self, item):
+        file, name = item
+        member = _Member(name, self.spool_size, self.compression)
+        try:
+            self.unistorage.download(file, member, chunk_size=self.chunk_size)
+            member.flush()
+        except:
+            member.content.close()
+            raise
+        return member
+
+    def __iter__(self):
+        files = list(self.files)
+        names = unique_names(file.name for file in files)
+        offset = 0
+        central_directory = []
+        for member in iter_ordered(self._download, zip(files, names), self.max_workers):
+            with member.content:
+                header = self._local_header(member)
+                yield header
+                for chunk in iter(lambda: member.content.read(self.chunk_size), ''):
+                    yield chunk
+            central_directory.append(self._central_header(member, offset))
+            offset += len(header) + member.compressed_size
+
+        size = 0
+        for header in central_directory:
+            yield header
+            size += len(header)
+        yield self._end_records(len(central_directory), size, offset)
+
+    def _encode_name(self, name):
+        if isinstance(name, unicode):
+            try:
+                return name.encode('ascii'), 0
+            except UnicodeEncodeError:
+                return name.encode('utf-8'), UTF8_FLAG
+        return name, 0
+
+    def _local_header(self, member):
+        name, flags = self._encode_name(member.name)
+        zip64 = member.size >= ZIP64_LIMIT or member.compressed_size >= ZIP64_LIMIT
+        extra = ''
+        compressed_size, size = member.compressed_size, member.size
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, size, compressed_size)
+            compressed_size = size = ZIP64_LIMIT
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, zip64 and 45 or 20, flags, self.compression,
+            self.date_time[0], self.date_time[1], member.crc & 0xFFFFFFFF,
+            compressed_size, size, len(name), len(extra)) + name + extra
+
+    def _central_header(self, member, offset):
+        name, flags = self._encode_name(member.name)
+        fields = []
+        size, compressed_size = member.size, member.compressed_size
+        if size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT:
+            fields += [size, compressed_size]
+            size = compressed_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+            offset = ZIP64_LIMIT
+        extra = ''
+        if fields:
+            extra = struct.pack('<HH%dQ' % len(fields), 1, 8 * len(fields), *fields)
+        version = fields and 45 or 20
+        # Made by UNIX, so that the external attributes are the file mode
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, 3 << 8 | version, version, flags,
+            self.compression, self.date_time[0], self.date_time[1],
+            member.crc & 0xFFFFFFFF, compressed_size, size, len(name), len(extra),
+            0, 0, 0, 0o600 << 16, offset) + name + extra
+
+    def _end_records(self, count, size, offset):
+        records = ''
+        if count >= ZIP64_COUNT_LIMIT or size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT:
+            records = struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, size, offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, offset + size, 1)
+            count, size, offset = (min(count, ZIP64_COUNT_LIMIT), min(size, ZIP64_LIMIT),
+                                   min(offset, ZIP64_LIMIT))
+        return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                                     size, offset, 0)